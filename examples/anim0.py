@@ -40,15 +40,12 @@ def frame_func(idx, t, frames):
         name = "tico", axis = [a2, b2, c2], angle = t*math.pi/5
     )
     mygrid.paint_canvas(paint="gradient")
-    mygrid.draw_shapes()
     cmap = rgb_to_cmap(
         colors = [[255,0,0], [255,255,255], [0,0,255]],
         penlow = [0,255,127],
         penhigh = [255,165,0]
     )
-    mygrid.plot_grid("pic.png", cmap=cmap, dpi=200)
-    frames.append(cv2.imread("pic.png"))
-    os.remove("pic.png")
+    return mygrid.render_frame(cmap=cmap, size=(1000, 1000))
 
 animation = Animation(
     time=np.linspace(0.1, 10, num=600),
@@ -58,5 +55,4 @@ animation = Animation(
     frame_size=(1000, 1000),
     animation_fname="anim0.mp4"
 )
-animation.process_frames()
-animation.write_video()
+animation.stream_video()
@@ -36,11 +36,8 @@ if __name__ == "__main__":
         mygrid.rotate_shape_3d(
             name="dodec", axis=[a2, b2, c2], angle=t*math.pi/max(time/2)
         )
-        mygrid.draw_shapes()
         cmap = rgb_to_cmap(colors=[[0, 48, 87]], penhigh=[179, 163, 105])
-        mygrid.plot_grid("pic.png", cmap=cmap, dpi=200)
-        frames.append(cv2.imread("pic.png"))
-        os.remove("pic.png")
+        return mygrid.render_frame(cmap=cmap, size=(1000, 1000))
 
     animation = Animation(
         time=time,
@@ -50,5 +47,4 @@ if __name__ == "__main__":
         frame_size=(1000, 1000),
         animation_fname="anim1.mp4"
     )
-    animation.process_frames()
-    animation.write_video()
+    animation.stream_video()
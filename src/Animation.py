@@ -1,12 +1,60 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import cv2
-import math
+from itertools import islice
 import numpy as np
 import os, sys
+import queue
+import threading
+
+from Camera import Camera
+from FrameCache import frame_key, scene_params
+from Grid import Grid
+from grid_utils import shade_to_image
+from Profiler import stage
+
+
+# End-of-stream marker passed between pipeline stages
+_DONE = object()
 
 
 class Animation:
     """Animation collects all aspects of the animation process including
-    creation of frames and video-writing using OpenCV."""
+    creation of frames and video-writing using OpenCV.
+
+    frame_func(idx, t, frames) renders the frame at time t. It may either
+    return the frame or append it to the list "frames". With workers > 1,
+    time steps are rendered in a pool of that many processes, so frame_func
+    must be picklable (defined at module level) and must not rely on state
+    carried over from earlier frames. At most max_inflight frames are pending
+    at once; they are handed on strictly in time order.
+
+    If a Profiler is given as "profiler", it is active while frames are
+    processed and written, and its report is printed at the end of
+    process_frames, write_video and stream_video and written as JSON to
+    profile_fname, if set. Stages reported from inside frame_func only show
+    up when frames are rendered in this process (workers=1), and memory
+    peaks are not reliable with "pipeline" (see Profiler).
+
+    frame_func may also return a Grid or a 2D array of shades, which is
+    colormapped with "cmap" and resized to frame_size. Grids are copied as
+    soon as frame_func returns, so it may keep drawing on the same Grid.
+    With "pipeline", colormapping and encoding run in their own threads,
+    connected to rendering and to each other by queues of at most
+    queue_size frames: the stages overlap wherever NumPy and OpenCV release
+    the GIL, and a slow stage holds back the ones before it rather than
+    letting frames pile up.
+
+    With a FrameCache as "cache", every converted frame is stored in it,
+    keyed by frame_key of its time value, cache_key, frame_size and cmap,
+    and frames already in the cache are read back instead of rendered. A
+    rerun with new video settings, or of a job that was interrupted, then
+    renders only the frames that are missing. cache_key must capture
+    everything else a frame depends on (see scene_params), either as a value
+    or as a function of t returning one, and must be given with a cache.
+    As with workers > 1, frame_func must render each frame from t alone.
+    from_timeline builds such a frame_func from a Timeline."""
 
     def __init__(
         self,
@@ -17,7 +65,16 @@ class Animation:
         frame_size=(1000, 1000),
         fourcc="mp4v",
         processed_fname="processed.npy",
-        animation_fname="animation.mp4"
+        animation_fname="animation.mp4",
+        workers=1,
+        max_inflight=None,
+        profiler=None,
+        profile_fname=None,
+        cmap="Greys",
+        pipeline=False,
+        queue_size=4,
+        cache=None,
+        cache_key=None
     ):
         self.time = time
         self.frame_func = frame_func
@@ -28,46 +85,346 @@ class Animation:
         self.fourcc = fourcc
         self.processed_fname = processed_fname
         self.animation_fname = animation_fname
+        self.workers = workers
+        self.max_inflight = max_inflight or 2*workers
+        self.profiler = profiler
+        self.profile_fname = profile_fname
+        self.cmap = cmap
+        self.pipeline = pipeline
+        self.queue_size = queue_size
+        if cache is not None and cache_key is None:
+            raise ValueError(
+                "cache_key is required with a cache: frame keys would "
+                "otherwise collide with those of any other animation"
+            )
+        self.cache = cache
+        self.cache_key = cache_key
+        self._keys = {}
+
+    @classmethod
+    def from_timeline(cls, timeline, grid, time, proj="persp", **kwargs):
+        """Animation of "grid" posed by "timeline" at every time in "time".
+        Each frame depends on t alone, so frames may be rendered by worker
+        processes or read from a cache; unless given, cache_key is taken
+        from the grid's starting state, the timeline and the projection,
+        which works for keyframed tracks only."""
+        if kwargs.get("cache") is not None and kwargs.get("cache_key") is None:
+            kwargs["cache_key"] = (
+                scene_params(grid),
+                timeline.params(),
+                Camera.from_proj(proj).key()
+            )
+        return cls(time, TimelineFrame(timeline, grid, proj), **kwargs)
+
+    def frames(self):
+        """Yields rendered frames in order, one at a time."""
+        if self.workers > 1:
+            yield from self._pooled_frames()
+            return
 
-    def process_frames(self):
-        frames = []
         for idx, t in enumerate(self.time):
-            sys.stdout.write(f"\rProcessing frame {idx+1} of {self.nframes}")
-            sys.stdout.flush()
-            self.frame_func(idx, t, frames)
+            self._progress(idx)
+            frame = self._lookup(idx, t)
+            if frame is None:
+                with stage("render"):
+                    frame = render_frame(self.frame_func, idx, t)
+            yield frame
+            self._tick()
 
-        np.save(self.processed_fname, frames)
+    def _pooled_frames(self):
+        """Renders frames in a process pool, keeping at most max_inflight
+        submitted and yielding them in time order. Frames found in the cache
+        are not submitted."""
+        hits = set()
+        if self.cache is not None:
+            hits = {
+                idx for idx, t in enumerate(self.time)
+                if self._frame_key(t) in self.cache
+            }
+        steps = (
+            (idx, t) for idx, t in enumerate(self.time) if idx not in hits
+        )
+        pending = deque()
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            submit = lambda step: pool.submit(
+                render_frame, self.frame_func, *step
+            )
+            for step in islice(steps, self.max_inflight):
+                pending.append(submit(step))
+
+            for idx, t in enumerate(self.time):
+                if idx in hits:
+                    frame = self._lookup(idx, t)
+                    if frame is None:
+                        # evicted since it was found
+                        frame = render_frame(self.frame_func, idx, t)
+                    self._progress(idx)
+                    yield frame
+                    self._tick()
+                    continue
+                if self.cache is not None:
+                    self._keys[idx] = self._frame_key(t)
+                with stage("render"):
+                    frame = pending.popleft().result()
+                for step in islice(steps, 1):
+                    pending.append(submit(step))
+                self._progress(idx)
+                yield frame
+                self._tick()
+
+    def _frame_key(self, t):
+        params = self.cache_key
+        if callable(params):
+            params = params(t)
+        return frame_key(t, params, self.frame_size, self.cmap)
+
+    def _lookup(self, idx, t):
+        """Returns the cached image of the frame at time t, or None if there
+        is no cache or the frame is not in it. Missing frames are noted so
+        that _convert stores them once rendered."""
+        if self.cache is None:
+            return None
+        key = self._frame_key(t)
+        with stage("cache"):
+            frame = self.cache.get(key)
+        if frame is None:
+            self._keys[idx] = key
+        return frame
+
+    def _tick(self):
+        """Counts a frame as done once the consumer has handled it."""
+        if self.profiler is not None:
+            self.profiler.tick()
+
+    def _progress(self, idx):
+        sys.stdout.write(f"\rProcessing frame {idx+1} of {self.nframes}")
+        sys.stdout.flush()
+
+    def process_frames(self):
+        """Renders every frame into the on-disk frame store processed_fname.
+        Frames are written as they are produced, so only one is held in memory
+        at a time."""
+        with self._profiling():
+            store = None
+
+            def consume(idx, image):
+                nonlocal store
+                store = self._store_frame(store, idx, image)
+
+            self._run(consume)
+            print("\n")
+            self._close_store(store)
 
     def write_video(self):
+        """Encodes the frames in processed_fname. The frame store is
+        memory-mapped rather than loaded."""
+        with self._profiling():
+            video = self._video_writer()
+            frames = np.load(self.processed_fname, mmap_mode="r")
+            self._write_cycles(video, frames, range(self.n_cycles))
+            self._release(video)
+
+    def stream_video(self):
+        """Renders frames and encodes each one as soon as it is produced. When
+        n_cycles > 1, frames are also written to the memory-mapped frame store
+        processed_fname, from which the remaining ping-pong passes are played
+        back, so peak memory stays at a few frames."""
+        with self._profiling():
+            video = self._video_writer()
+            store = None
+
+            def consume(idx, image):
+                nonlocal store
+                with stage("encode"):
+                    video.write(image)
+                if self.n_cycles > 1:
+                    store = self._store_frame(store, idx, image)
+
+            self._run(consume)
+            print("\n")
+
+            if store is not None:
+                self._close_store(store)
+                frames = np.load(self.processed_fname, mmap_mode="r")
+                self._write_cycles(video, frames, range(1, self.n_cycles))
+            self._release(video)
+
+    def _run(self, consume):
+        """Renders every frame, converts it to an image and calls
+        consume(idx, image) on it, in order. With "pipeline", conversion and
+        consume run in two threads fed through bounded queues."""
+        self._keys = {}
+        if not self.pipeline:
+            for idx, frame in enumerate(self.frames()):
+                consume(idx, self._convert(idx, self._snapshot(frame)))
+            return
+
+        errors = []
+        snapshots = queue.Queue(maxsize=self.queue_size)
+        images = queue.Queue(maxsize=self.queue_size)
+        convert = lambda idx, frame: (idx, self._convert(idx, frame))
+        threads = [
+            threading.Thread(
+                target=_run_stage, args=(convert, snapshots, images, errors)
+            ),
+            threading.Thread(
+                target=_run_stage, args=(consume, images, None, errors)
+            )
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for idx, frame in enumerate(self.frames()):
+                if errors:
+                    break
+                snapshots.put((idx, self._snapshot(frame)))
+        finally:
+            snapshots.put(_DONE)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+    def _snapshot(self, frame):
+        """Detaches a frame from objects frame_func may go on changing: a Grid
+        is replaced by a copy of its shades, oriented as in Grid.to_image."""
+        if isinstance(frame, Grid):
+            return snapshot(frame)
+        return frame
+
+    def _convert(self, idx, frame):
+        """Converts frame idx to an image and stores it in the cache if it
+        was rendered rather than read from there."""
+        image = self._to_image(frame)
+        key = self._keys.pop(idx, None)
+        if key is not None:
+            with stage("cache"):
+                self.cache.put(key, image)
+        return image
+
+    def _to_image(self, frame):
+        """Colormaps a 2D array of shades to a BGR image of frame_size; BGR
+        images are passed through."""
+        if frame.ndim == 2:
+            return shade_to_image(frame, cmap=self.cmap, size=self.frame_size)
+        return frame
+
+    @contextmanager
+    def _profiling(self):
+        """Activates the profiler, if any, for the enclosed block, then
+        prints its report and writes it to profile_fname."""
+        if self.profiler is None:
+            yield
+            return
+        self.profiler.activate()
+        try:
+            yield
+        finally:
+            self.profiler.deactivate()
+            print(self.profiler.report())
+            if self.profile_fname is not None:
+                self.profiler.dump(self.profile_fname)
+
+    def _store_frame(self, store, idx, frame):
+        """Writes frame to position idx of the frame store, creating the store
+        from the first frame's shape and dtype if it does not exist yet."""
+        with stage("store"):
+            return self._write_store(store, idx, frame)
+
+    def _write_store(self, store, idx, frame):
+        if store is None:
+            store = np.lib.format.open_memmap(
+                self.processed_fname,
+                mode="w+",
+                dtype=frame.dtype,
+                shape=(self.nframes,) + frame.shape
+            )
+        store[idx] = frame
+        return store
+
+    def _close_store(self, store):
+        if store is not None:
+            store.flush()
+
+    def _video_writer(self):
         fourcc = cv2.VideoWriter_fourcc(*self.fourcc)
         # frame size must meet or exceed resolution determined by dpi and fig
         # size specified in grid
-        video = cv2.VideoWriter(
+        return cv2.VideoWriter(
             self.animation_fname,
             fourcc,
             self.fps,
             self.frame_size
         )
 
-        frames = np.load(self.processed_fname)
-        m, n = self.nframes, len(str(self.nframes))
+    def _write_cycles(self, video, frames, cycles):
+        """Writes "frames" to video once per cycle, alternating between
+        forward and reversed order for ping-pong playback."""
+        m, n = len(frames), len(str(len(frames)))
         message = lambda i: (
             f"\rWriting frame: {i+1}" + (n-len(str(i+1)))*" " + " to video "
         )
 
-        for cycle in range(self.n_cycles):
-            enum = (
-                enumerate(frames)
-                if cycle % 2 == 0
-                else zip(range(m-1,-1,-1), reversed(frames))
-            )
-
-            for idx, image in enum:
+        for cycle in cycles:
+            order = range(m) if cycle % 2 == 0 else range(m-1, -1, -1)
+            for idx in order:
                 if idx % 10 == 0:
                     sys.stdout.write(message(idx))
                     sys.stdout.flush()
-                video.write(image)
+                with stage("encode"):
+                    video.write(np.ascontiguousarray(frames[idx]))
 
+    def _release(self, video):
         print("\n")
         cv2.destroyAllWindows()
         video.release()
+
+
+def _run_stage(func, inbox, outbox, errors):
+    """Body of a pipeline thread: calls func on every item taken from inbox
+    and puts the results in outbox, if any, until _DONE arrives, which is
+    passed on. After an error anywhere in the pipeline, items are drained
+    without being processed so that earlier stages never block."""
+    while True:
+        item = inbox.get()
+        if item is _DONE:
+            break
+        if errors:
+            continue
+        try:
+            result = func(*item)
+        except BaseException as exc:
+            errors.append(exc)
+            continue
+        if outbox is not None:
+            outbox.put(result)
+    if outbox is not None:
+        outbox.put(_DONE)
+
+def render_frame(frame_func, idx, t):
+    """Calls frame_func for one time step and returns the frame it rendered,
+    whether it was returned or appended to the list passed in."""
+    frames = []
+    frame = frame_func(idx, t, frames)
+    return frame if frame is not None else frames[-1]
+
+def snapshot(grid):
+    """Copy of the shades of "grid", oriented as in Grid.to_image."""
+    arr = grid.composite()
+    return np.array(np.rot90(arr) if grid.zerobottomleft else arr)
+
+
+class TimelineFrame:
+    """frame_func posing "grid" with "timeline" and drawing it. Being a
+    module-level class, it can be sent to worker processes."""
+
+    def __init__(self, timeline, grid, proj="persp"):
+        self.timeline = timeline
+        self.grid = grid
+        self.proj = proj
+
+    def __call__(self, idx, t, frames):
+        self.timeline.pose(self.grid, t)
+        self.grid.draw_shapes(proj=self.proj)
+        return snapshot(self.grid)
@@ -0,0 +1,162 @@
+import numpy as np
+
+from shape_utils import apply_affine
+
+
+# Smallest w a vertex may have under the "perspective" projection; vertices
+# nearer the camera plane or behind it are culled
+NEAR_W = 1e-3
+
+class Camera:
+    """Camera maps 3D world coordinates onto the x-y plane of a grid. A 4x4
+    "view" matrix takes world coordinates to camera coordinates, after which
+    one of three projections is applied:
+
+        "ortho": drop z.
+        "weak": scale x and y about the anchor point by
+            focal / (focal + 2*|z|), where z is the depth of the anchor. Every
+            vertex of a shape gets the same factor.
+        "perspective": per-vertex perspective divide by
+            w = 1 + 2*z / focal about the anchor's (x, y). Vertices with
+            w <= NEAR_W, at or behind the camera plane, are culled: their
+            grid coordinates are NaN, and Grid drops every edge and face
+            that touches one rather than drawing it mirrored.
+
+    The camera looks along +z, so camera-space depth grows away from it and
+    smaller depths are nearer. The anchor is either "com", the center of mass
+    of the shape being projected, or a fixed world-space point. "focal"
+    defaults to the largest grid dimension. The legacy "persp" and "ortho"
+    projections of Grid.draw_shapes are available as the Camera.persp and
+    Camera.ortho presets."""
+
+    def __init__(self, view=None, proj="weak", focal=None, anchor="com"):
+        assert proj in ("ortho", "weak", "perspective"), (
+            "proj must be 'ortho', 'weak' or 'perspective'"
+        )
+        self.view = (
+            np.eye(4) if view is None else np.asarray(view, dtype=float)
+        )
+        self.proj = proj
+        self.focal = focal
+        self.anchor = anchor
+
+    @classmethod
+    def persp(cls, view=None, focal=None):
+        """Weak perspective about each shape's center of mass."""
+        return cls(view=view, proj="weak", focal=focal, anchor="com")
+
+    @classmethod
+    def ortho(cls, view=None):
+        """Orthographic projection onto the x-y plane."""
+        return cls(view=view, proj="ortho")
+
+    @classmethod
+    def from_proj(cls, proj):
+        """Return proj if it is already a Camera, else the preset it names."""
+        if isinstance(proj, cls):
+            return proj
+        presets = {"persp":cls.persp, "ortho":cls.ortho}
+        return presets[proj]()
+
+    def key(self):
+        """Hashable summary of the camera's settings."""
+        return (
+            self.proj, self.focal, str(self.anchor), self.view.tobytes()
+        )
+
+    def matrix(self, griddim, com=None):
+        """4x4 homogeneous matrix taking world coordinates to projected
+        coordinates (before the divide by w). "com" is the world-space center
+        of mass used when the anchor is "com"."""
+        if self.proj == "ortho":
+            return self.view
+        return self.matrices(griddim, [np.zeros(3) if com is None else com])[0]
+
+    def matrices(self, griddim, coms):
+        """(K, 4, 4) stack of the matrices given by "matrix" for each of the
+        K rows of the array of centers of mass "coms", built at once."""
+        coms = np.asarray(coms, dtype=float).reshape(-1, 3)
+        if self.proj == "ortho":
+            return np.broadcast_to(self.view, (len(coms), 4, 4))
+
+        focal = self.focal if self.focal is not None else max(griddim)
+        if isinstance(self.anchor, str):
+            anchors = coms
+        else:
+            anchors = np.tile(
+                np.asarray(self.anchor, dtype=float), (len(coms), 1)
+            )
+        xc, yc, zc = apply_affine(anchors, self.view).T
+        proj = np.tile(np.eye(4), (len(coms), 1, 1))
+
+        if self.proj == "weak":
+            s = focal / (focal + 2*np.abs(zc))
+            proj[:, 0, 0], proj[:, 1, 1] = s, s
+            proj[:, 0, 3], proj[:, 1, 3] = (1-s)*xc, (1-s)*yc
+        elif self.proj == "perspective":
+            proj[:, 0, 2], proj[:, 1, 2] = 2*xc/focal, 2*yc/focal
+            proj[:, 3, 2] = 2/focal
+
+        return proj @ self.view
+
+    def project(self, points, griddim, com=None):
+        """Project an (N, 3) array of world-space points. Returns an (N, 2)
+        array of grid coordinates and an (N,) array of camera-space depths."""
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        if com is None and isinstance(self.anchor, str) and len(points):
+            com = points.mean(axis=0)
+        return _divide(points, self.matrix(griddim, com=com))
+
+    def project_shape(self, shp, griddim):
+        """Project every vertex of a 3D Shape with one matrix multiply. The
+        shape's pending transform and scene graph parents are folded into
+        the camera matrix, so its vertices are not materialized."""
+        mat = self.matrix(griddim, com=shp.world_com()) @ shp.world_matrix()
+        return _divide(shp.base_pos, mat)
+
+    def project_shapes(self, shapes, griddim):
+        """Project the vertices of many 3D Shapes in a single batched multiply.
+        Returns a list of (xy, depth) pairs, one per shape."""
+        if not shapes:
+            return []
+        coms = [shp.world_com() for shp in shapes]
+        mats = self.matrices(griddim, coms) @ np.stack(
+            [shp.world_matrix() for shp in shapes]
+        )
+        counts = [len(shp.base_pos) for shp in shapes]
+        owner = np.repeat(np.arange(len(shapes)), counts)
+        points = np.concatenate([shp.base_pos for shp in shapes])
+        xy, depth = _divide(points, mats[owner])
+        bounds = np.cumsum(counts)[:-1]
+        return list(zip(np.split(xy, bounds), np.split(depth, bounds)))
+
+    def project_instances(self, shp, griddim):
+        """Project every vertex of every instance of a 3D InstancedShape with
+        one batched multiply. Returns a (K*N, 2) array of grid coordinates
+        and a (K*N,) array of depths, instance by instance."""
+        world = shp.world_transforms()
+        mats = self.matrices(griddim, shp.instance_coms(world)) @ world
+        homog = np.concatenate(
+            [shp.base_pos, np.ones((len(shp.base_pos), 1))], axis=1
+        )
+        out = np.einsum("kij,nj->kni", mats, homog).reshape(-1, 4)
+        return _dehomogenize(out)
+
+
+def _divide(points, mat):
+    """Apply a 4x4 matrix, or an (N, 4, 4) stack of per-point matrices, to
+    (N, 3) points and perform the perspective divide."""
+    homog = np.concatenate([points, np.ones((len(points), 1))], axis=1)
+    if mat.ndim == 2:
+        out = homog @ mat.T
+    else:
+        out = np.einsum("nij,nj->ni", mat, homog)
+    return _dehomogenize(out)
+
+def _dehomogenize(out):
+    """Grid coordinates and depths of (N, 4) homogeneous points, with NaN
+    coordinates for points culled by the near plane w = NEAR_W."""
+    w = out[:, 3:]
+    culled = w <= NEAR_W
+    xy = out[:, :2] / np.where(culled, 1, w)
+    return np.where(culled, np.nan, xy), out[:, 2]
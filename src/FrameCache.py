@@ -0,0 +1,162 @@
+import hashlib
+from matplotlib.colors import Colormap
+import numpy as np
+import os
+import tempfile
+
+from grid_utils import cmap_lut
+
+
+class FrameCache:
+    """FrameCache keeps rendered frames on disk in "directory", one .npy file
+    per frame named by its key, so that they outlive the process that
+    rendered them. Keys are content hashes of everything a frame depends on
+    (see frame_key); the same frame is found again by any run that computes
+    the same key, and a changed parameter simply misses.
+
+    Files are written to a temporary name and renamed into place, so a crash
+    never leaves a partial frame behind, and several processes may share the
+    directory. Every hit refreshes the file's modification time, and once the
+    files add up to more than max_bytes, the least recently used ones are
+    deleted until they fit again."""
+
+    def __init__(self, directory, max_bytes=2**32):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._size = self.size()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+    def get(self, key):
+        """Returns the frame stored under key, or None if there is none."""
+        path = self.path(key)
+        try:
+            frame = np.load(path)
+            os.utime(path)
+        except (FileNotFoundError, ValueError, EOFError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return frame
+
+    def put(self, key, frame):
+        """Stores frame under key, then evicts least recently used frames
+        if the cache is over max_bytes."""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.asarray(frame))
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self._size += os.path.getsize(self.path(key))
+        if self._size > self.max_bytes:
+            self.evict(keep=key)
+
+    def entries(self):
+        """List of (last use, bytes, path) for every stored frame."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def size(self):
+        """Total bytes of the stored frames."""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Deletes the least recently used frames until the rest fit in
+        max_bytes. The frame stored under "keep" is never deleted. The
+        directory is scanned afresh, so frames written by other processes
+        count too."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        keep = None if keep is None else self.path(keep)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._size = 0
+
+
+def frame_key(*parts):
+    """Hex SHA-256 digest of "parts", which may be nested lists, tuples and
+    dicts of strings, numbers, None, NumPy arrays and matplotlib Colormaps.
+    Arrays are hashed by dtype, shape and contents and Colormaps by their
+    cmap_lut table, so equal parameters give equal keys across processes
+    and runs."""
+    digest = hashlib.sha256()
+    _feed(digest, parts)
+    return digest.hexdigest()
+
+def _feed(digest, obj):
+    if isinstance(obj, (np.ndarray, np.generic)):
+        arr = np.ascontiguousarray(obj)
+        digest.update(f"array:{arr.dtype.str}:{arr.shape}:".encode())
+        digest.update(arr.tobytes())
+    elif isinstance(obj, Colormap):
+        digest.update(b"cmap:")
+        _feed(digest, cmap_lut(obj))
+    elif isinstance(obj, dict):
+        digest.update(f"dict:{len(obj)}:".encode())
+        for key in sorted(obj, key=repr):
+            _feed(digest, key)
+            _feed(digest, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        digest.update(f"{type(obj).__name__}:{len(obj)}:".encode())
+        for item in obj:
+            _feed(digest, item)
+    elif obj is None or isinstance(obj, (str, bytes, bool, int, float)):
+        digest.update(f"{type(obj).__name__}:{obj!r};".encode())
+    else:
+        raise TypeError(f"cannot hash {type(obj).__name__} into a frame key")
+
+def scene_params(grid):
+    """Parameters a frame of "grid" depends on, for use in frame_key: its
+    size, dtype, orientation and canvas paint, and every shape's world-space
+    vertices, edges, faces and shades."""
+    shapes = {}
+    for name, shp in grid.shapes.items():
+        shapes[name] = {
+            "pos":shp.world_pos(),
+            "edges":shp.edges,
+            "faces":shp.faces,
+            "shade":getattr(shp, "shades", getattr(shp, "shade", None)),
+            "fill":shp.fill
+        }
+    return {
+        "dim":grid.dim,
+        "dtype":grid.dtype.str,
+        "zerobottomleft":grid.zerobottomleft,
+        "paint":grid.gridcur,
+        "shapes":shapes
+    }
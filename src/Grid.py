@@ -1,102 +1,302 @@
-import functools
 import matplotlib.pyplot as plt
 import numpy as np
+import warnings
 
+from Camera import Camera
 from grid_utils import *
+from Profiler import timed
+from InstancedShape import InstancedShape
 from Shape import Shape
-from shape_utils import center_of_mass
 
 
 class Grid:
+    """Grid rasterizes shapes onto a 2D array of shades.
 
-    def __init__(self, shapes, dim, zerobottomleft=True):
+    draw_shapes redraws incrementally: Grid remembers the screen-space
+    bounding box and projected edges of every shape it drew, and on the next
+    call only the rectangles covered by shapes that changed (old and new
+    position) are restored from the canvas and re-rasterized. A shape counts
+    as changed if it was added or transformed through Grid, or if its
+    version or shades differ from the last draw. Repainting the canvas or
+    changing the projection forces a full redraw.
+
+    "dtype" sets the type of the canvas and gridarr. float32 halves their
+    size; with uint8 or uint16, shades are quantized to 255 or 65535
+    levels (see quantize). gridarr is refreshed from the canvas in place,
+    so redrawing allocates no new full-size arrays.
+
+    Shapes with faces and a "fill" shade are drawn solid: their faces are
+    filled through the depth buffer "zbuf", so nearer faces occlude farther
+    ones across all shapes. Edges are drawn on top, depth-tested against
+    zbuf, so faces also hide the edges behind them.
+
+    "shapes" may also hold InstancedShapes, whose copies are projected and
+    rasterized together as a single shape. Shapes that hang under a
+    SceneNode are drawn in world coordinates, and count as changed when any
+    node above them is transformed."""
+
+    def __init__(self, shapes, dim, zerobottomleft=True, dtype="float64"):
         assert isinstance(shapes, list), "shapes must be in a list"
         assert isinstance(dim, tuple), "dim must be tuple of length >= 2"
 
         self.shapes = {shape.name:shape for shape in shapes}
         self.dim = np.array(dim)
-        self.canvas = np.zeros(dim)
-        self.gridarr = np.zeros(dim)
+        self.dtype = np.dtype(dtype)
+        self.canvas = self._buffer("canvas")
+        self.gridarr = self._buffer("gridarr")
         self.gridcur = "white"
         self.zerobottomleft = zerobottomleft
+        self.dirty = set(self.shapes)
+        self.zbuf = None
+        self._drawn = None
+        self._drawn_view = None
     
+    def _buffer(self, name):
+        """Allocates the full-size array "name", canvas or gridarr."""
+        return np.zeros(tuple(self.dim), dtype=self.dtype)
+
     def add_shape(self, shp):
         self.shapes[shp.name] = shp
+        self.dirty.add(shp.name)
     
+    def add_group(self, node):
+        """Adds every shape in the subtree of the SceneNode "node"."""
+        for shp in node.shapes():
+            self.add_shape(shp)
+
     def del_shape(self, shp):
         del self.shapes[shp.name]
+        self.dirty.discard(shp.name)
         
     def scale_shape(self, name, factor):
         self.shapes[name].scale(factor=factor)
+        self.dirty.add(name)
     
     def rotate_shape_2d(self, name, origin, angle):
         self.shapes[name].rotate_2d(origin=origin, angle=angle)
+        self.dirty.add(name)
         
     def rotate_shape_3d(self, name, axis, angle, center="com"):
         self.shapes[name].rotate_3d(center=center, axis=axis, angle=angle)
+        self.dirty.add(name)
         
     def translate_shape(self, name, direction):
         self.shapes[name].translate(direction=direction)
+        self.dirty.add(name)
     
+    def _check_paint(self, paint):
+        """Warns if "paint" is a uniform shade outside [0, 1]."""
+        if not isinstance(paint, str) and (paint < 0 or paint > 1):
+            warnings.warn(
+                "Uniform shade should be between 0 and 1."
+                "Plot may not appear as intended."
+            )
+
+    @timed("paint_canvas")
     def paint_canvas(self, paint="white"):
-        try:
-            if paint < 0 or paint > 1:
-                Warning(
-                    "Uniform shade should be between 0 and 1."
-                    "Plot may not appear as intended."
+        self._check_paint(paint)
+        painted = painted_canvas(
+            paint, tuple(int(d) for d in self.dim), self.canvas.dtype.str
+        )
+        np.copyto(self.canvas, painted)
+        self.gridcur = paint
+        self._drawn = None
+        
+    @timed("draw_shapes")
+    def draw_shapes(self, shapes="all", proj="persp", hidden=False):
+        """Draws the edges of "shapes" over the canvas. 3D shapes are projected
+        with "proj", either a Camera or the name of a Camera preset
+        ("persp" or "ortho"). If "hidden", edges of 3D shapes with faces are
+        culled when every face bordering them points away from the camera,
+        and back faces are not filled."""
+        names = [name for name in self.shapes] if shapes=="all" else shapes
+        camera = Camera.from_proj(proj)
+        view = (
+            shapes if shapes=="all" else tuple(shapes), camera.key(), hidden
+        )
+
+        if self._drawn is None or view != self._drawn_view:
+            self._drawn, self._drawn_view = {}, view
+            changed = names
+        else:
+            changed = [
+                name for name in names
+                if name in self.dirty
+                or name not in self._drawn
+                or self._drawn[name]["state"] != _state(self.shapes[name])
+            ]
+
+        stale = [
+            self._drawn.pop(name)["bbox"]
+            for name in list(self._drawn)
+            if name in changed or name not in names
+        ]
+        self._drawn.update(self._project(changed, camera, hidden))
+        self.dirty.clear()
+
+        if len(changed) == len(names) and not stale:
+            np.copyto(self.gridarr, self.canvas)
+            if self.zbuf is not None:
+                self.zbuf.fill(np.inf)
+            self._rasterize(names)
+            return
+
+        rects = [
+            rect for rect in stale + [self._drawn[n]["bbox"] for n in changed]
+            if rect[0] < rect[1] and rect[2] < rect[3]
+        ]
+        for r0, r1, c0, c1 in rects:
+            self.gridarr[r0:r1, c0:c1] = self.canvas[r0:r1, c0:c1]
+            if self.zbuf is not None:
+                self.zbuf[r0:r1, c0:c1] = np.inf
+        self._rasterize(
+            [
+                name for name in names
+                if name in changed
+                or rects_overlap(self._drawn[name]["bbox"], rects)
+            ],
+            clip=rects
+        )
+
+    @timed("project")
+    def _project(self, names, camera, hidden=False):
+        """Projects the edges and filled faces of the named shapes onto the
+        grid. Returns a dict of per-shape draw records: edge endpoints and
+        shades, triangles with their vertex depths and fill shades,
+        screen-space bounding box and the shape state they were computed
+        from. All instances of an InstancedShape go into one record."""
+        shps = [self.shapes[name] for name in names]
+        solids = [
+            shp for shp in shps
+            if shp.dims == 3 and not isinstance(shp, InstancedShape)
+        ]
+        projected = dict(zip(
+            [id(shp) for shp in solids],
+            camera.project_shapes(solids, griddim=self.dim)
+        ))
+        records = {}
+
+        for name, shp in zip(names, shps):
+            instanced = isinstance(shp, InstancedShape)
+            if shp.dims == 2:
+                pts = shp.world_pos()
+                depth = np.zeros(len(pts))
+            elif instanced:
+                pts, depth = camera.project_instances(shp, griddim=self.dim)
+            else:
+                pts, depth = projected[id(shp)]
+
+            if instanced:
+                edges, faces = shp.all_edges(), shp.all_faces()
+                tris = shp.all_triangles()
+                shades = np.repeat(shp.shades, len(shp.edges))
+            else:
+                edges, faces, tris = shp.edges, shp.faces, shp.triangles()
+                shades = np.full(len(edges), shp.shade, dtype=float)
+            if shp.fill is None:
+                tris = tris[:0]
+
+            if hidden and shp.dims == 3 and faces is not None:
+                pairs = shp.all_edge_faces() if instanced else shp.edge_faces()
+                keep = visible_edges(
+                    len(edges), pairs, front_facing(pts, faces)
                 )
-            enum = map(
-                functools.partial(uniform_shade, shade=paint),
-                np.ndenumerate(self.canvas)
-            )
-        except:
-            paint_types = {
-                "gradient":gradient,
-                "radial":radial,
-                "white":white,
-                "black":black
+                edges, shades = edges[keep], shades[keep]
+                if len(tris):
+                    tris = tris[front_facing(pts, tris)]
+
+            # drop edges and faces with vertices culled by the camera
+            starts, ends = pts[edges[:, 0]], pts[edges[:, 1]]
+            drawn = np.isfinite(starts).all(axis=1)
+            drawn &= np.isfinite(ends).all(axis=1)
+            starts, ends, shades = starts[drawn], ends[drawn], shades[drawn]
+            edge_depths = depth[edges[drawn]]
+            tris = tris[np.isfinite(pts[tris]).all(axis=(1, 2))]
+            records[name] = {
+                "starts":starts,
+                "ends":ends,
+                "shades":shades,
+                "depths":edge_depths,
+                "tris":pts[tris],
+                "tri_depths":depth[tris],
+                "fills":np.full(len(tris), shp.fill, dtype=float),
+                "bbox":edge_bbox(
+                    np.concatenate([starts, pts[tris].reshape(-1, 2)]),
+                    ends,
+                    self.dim
+                ),
+                "state":_state(shp)
             }
-            func = paint_types[paint]
-            enum = map(
-                functools.partial(func, dim=self.dim),
-                np.ndenumerate(self.canvas)
+
+        return records
+
+    def _rasterize(self, names, clip=None):
+        """Rasterizes the recorded faces and then the recorded edges of the
+        named shapes into gridarr, in order, optionally restricted to the
+        rectangles in "clip". Faces of all shapes share the depth buffer
+        "zbuf"; edges are drawn over them, hidden where a face is nearer."""
+        records = [self._drawn[name] for name in names]
+        if not records:
+            return
+
+        filled = [rec for rec in records if len(rec["tris"])]
+        zbuf = None
+        if filled:
+            if self.zbuf is None:
+                self.zbuf = np.full(self.gridarr.shape, np.inf)
+            draw_faces(
+                self.gridarr,
+                np.concatenate([rec["tris"] for rec in filled]),
+                dim=self.dim,
+                shades=np.concatenate([rec["fills"] for rec in filled]),
+                depths=np.concatenate([rec["tri_depths"] for rec in filled]),
+                zbuf=self.zbuf,
+                clip=clip
             )
+            zbuf = self.zbuf
 
-        for idx, val in enum:
-            val = 0.005 if val < 0.005 else val
-            val = 0.995 if val > 0.995 else val
-            self.canvas[idx] = val
+        draw_edges(
+            self.gridarr,
+            np.concatenate([rec["starts"] for rec in records]),
+            np.concatenate([rec["ends"] for rec in records]),
+            dim=self.dim,
+            shades=np.concatenate([rec["shades"] for rec in records]),
+            depths=np.concatenate([rec["depths"] for rec in records]),
+            zbuf=zbuf,
+            clip=clip
+        )
 
-        self.gridcur = paint
-        
-    def draw_shapes(self, shapes="all", proj="persp"):
-        shapes = [name for name in self.shapes] if shapes=="all" else shapes
-        gridout = np.array(self.canvas)
+    def composite(self):
+        """Returns the dense array of shades drawn so far, gridarr."""
+        return self.gridarr
 
-        for name in shapes:
-            shp = self.shapes[name]
-            if shp.dims == 2:
-                edges = [
-                    (shp.nodes[edge[0]]["pos"], shp.nodes[edge[1]]["pos"])
-                    for edge in list(shp.edges)
-                ]
-            elif shp.dims == 3:
-                edges = [
-                    (
-                        projection(shp, edge[0], griddim=self.dim, proj=proj),
-                        projection(shp, edge[1], griddim=self.dim, proj=proj)
-                    )
-                    for edge in list(shp.edges)
-                ]
-
-            for edge in edges:
-                p1, p2 = edge
-                gridout = draw_edge(gridout, p1, p2, dim=self.dim, shade=shp.shade)
-
-        self.gridarr = gridout
+    def to_image(self, cmap="Greys", size=None, out=None):
+        """Returns gridarr as a BGR uint8 image of the given (width, height),
+        oriented as in plot_grid, without going through a matplotlib figure
+        or a file. The result can be passed straight to Animation."""
+        gridarr = self.composite()
+        gridout = np.rot90(gridarr) if self.zerobottomleft else gridarr
+        return shade_to_image(gridout, cmap=cmap, size=size, out=out)
 
+    def render_frame(
+        self,
+        cmap="Greys",
+        size=None,
+        shapes="all",
+        proj="persp",
+        hidden=False,
+        out=None
+    ):
+        """Draws shapes over the canvas and returns the result as a BGR uint8
+        image; see draw_shapes and to_image."""
+        self.draw_shapes(shapes=shapes, proj=proj, hidden=hidden)
+        return self.to_image(cmap=cmap, size=size, out=out)
+
+    @timed("plot_grid")
     def plot_grid(self, filename=None, cmap="Greys", dpi=500):
-        gridout = np.rot90(self.gridarr) if self.zerobottomleft else self.gridarr
+        gridarr = self.composite()
+        gridout = np.rot90(gridarr) if self.zerobottomleft else gridarr
+        gridout = gridout / shade_scale(self.dtype)
         fig, ax = plt.subplots(1, figsize=(5, 5), dpi=dpi)
         ax.imshow(gridout, cmap=cmap, interpolation="None", vmin=0, vmax=1)
         ax.axes.get_xaxis().set_visible(False)
@@ -107,3 +307,13 @@ class Grid:
         if filename is not None:
             fig.savefig(filename, dpi=dpi)
         plt.close()
+
+
+def _state(shp):
+    """Identifies the geometry and shades a shape was drawn with, including
+    the stamp of its SceneNode parent. The shades of an InstancedShape only
+    change through set_shades, which bumps its version."""
+    shade = None if isinstance(shp, InstancedShape) else shp.shade
+    parent = shp.parent
+    stamp = None if parent is None else (id(parent), parent.stamp)
+    return (id(shp), shp.version, shade, shp.fill, stamp)
@@ -0,0 +1,187 @@
+import numpy as np
+
+from shape_utils import (
+    affine_matrix,
+    edge_face_pairs,
+    fan_triangles,
+    rotation_matrix,
+    rotation_matrix_2d,
+    tile_indices
+)
+
+
+class InstancedShape:
+    """InstancedShape draws K copies of one template wireframe. The template
+    is an (N, dims) float array "base_pos" with (N_edges, 2) "edges" and
+    optional (N_faces, k) "faces", as in Shape; each copy is placed by its
+    own 4x4 homogeneous matrix in the (K, 4, 4) array "transforms" and drawn
+    with its own entry of the (K,) array "shades". Grid transforms and
+    rasterizes all copies together, so thousands of small solids cost a few
+    array operations rather than thousands of Shapes.
+
+    translate, scale and rotate act on the whole set of copies, like the
+    Shape methods of the same names; transform_instances applies a separate
+    matrix to each copy. "version" is incremented by every change, as in
+    Shape, and a SceneNode parent places all copies as it does a Shape."""
+
+    def __init__(
+        self,
+        name,
+        pos,
+        edges,
+        faces=None,
+        transforms=None,
+        shades=1,
+        fill=None,
+        dims=3
+    ):
+        self.version = 0
+        self.name = name
+        self.dims = dims
+        self.base_pos = np.asarray(pos, dtype=float).reshape(-1, dims)
+        self.edges = np.asarray(edges, dtype=np.intp).reshape(-1, 2)
+        self.faces = (
+            None if faces is None else np.asarray(faces, dtype=np.intp)
+        )
+        self.fill = fill
+        self.parent = None
+        self._edge_faces = None
+        self.set_transforms(
+            np.eye(4)[None] if transforms is None else transforms
+        )
+        self.set_shades(shades)
+
+    @property
+    def count(self):
+        """Number of instances."""
+        return len(self.transforms)
+
+    @property
+    def pos(self):
+        """(K*N, dims) array of the vertex positions of every instance,
+        instance by instance."""
+        return self.instance_pos().reshape(-1, self.dims)
+
+    def instance_pos(self, transforms=None):
+        """(K, N, dims) array of vertex positions, one block per instance,
+        placed by "transforms" (self.transforms by default)."""
+        d = self.dims
+        mats = self.transforms if transforms is None else transforms
+        return (
+            np.einsum("kij,nj->kni", mats[:, :d, :d], self.base_pos)
+            + mats[:, None, :d, 3]
+        )
+
+    def set_transforms(self, transforms):
+        """Replace the (K, 4, 4) per-instance matrices, which may change the
+        number of instances."""
+        self.transforms = np.array(transforms, dtype=float).reshape(-1, 4, 4)
+        self.version += 1
+
+    def set_shades(self, shades):
+        """Set the edge shade of every instance from a scalar or (K,) array."""
+        self.shades = np.array(
+            np.broadcast_to(np.asarray(shades, dtype=float), (self.count,))
+        )
+        self.version += 1
+
+    def set_fill(self, fill):
+        """Set the shade used to fill faces, or None to draw edges only."""
+        self.fill = fill
+        self.version += 1
+
+    def transform(self, mat):
+        """Compose the 4x4 homogeneous matrix "mat" into every instance."""
+        self.transforms = mat @ self.transforms
+        self.version += 1
+        return self
+
+    def transform_instances(self, mats):
+        """Compose the k-th matrix of the (K, 4, 4) array "mats" into the
+        k-th instance."""
+        self.transforms = np.asarray(mats) @ self.transforms
+        self.version += 1
+        return self
+
+    def translate(self, direction):
+        self.transform(affine_matrix(offset=direction))
+
+    def scale(self, factor, center="com"):
+        assert factor >= 0, "factor must be non-negative"
+
+        center = self.get_com() if center == "com" else np.asarray(center)
+        self.transform(affine_matrix(linear=factor*np.eye(3), center=center))
+
+    def rotate_2d(self, origin, angle):
+        rot = rotation_matrix_2d(angle)
+        return self.transform(affine_matrix(linear=rot, center=origin))
+
+    def rotate_3d(self, axis, angle, center="com"):
+        center = self.get_com() if center == "com" else np.asarray(center)
+        rot = rotation_matrix(axis, angle)
+        self.transform(affine_matrix(linear=rot, center=center))
+
+    def world_transforms(self):
+        """Per-instance matrices composed with the world matrix of the
+        SceneNode self hangs under, if any."""
+        if self.parent is None:
+            return self.transforms
+        return self.parent.world() @ self.transforms
+
+    def world_pos(self):
+        """(K*N, dims) array of vertex positions in world coordinates."""
+        return self.instance_pos(self.world_transforms()).reshape(
+            -1, self.dims
+        )
+
+    def instance_coms(self, transforms=None):
+        """(K, dims) array of the center of mass of each instance, placed by
+        "transforms" (self.transforms by default)."""
+        d = self.dims
+        mats = self.transforms if transforms is None else transforms
+        return mats[:, :d, :d] @ self.base_pos.mean(axis=0) + mats[:, :d, 3]
+
+    def get_com(self):
+        """Get dims-dimensional center of mass of the vertices of all
+        instances."""
+        return self.instance_coms().mean(axis=0)
+
+    def world_com(self):
+        """Center of mass of all instances in world coordinates."""
+        return self.instance_coms(self.world_transforms()).mean(axis=0)
+
+    def edge_faces(self):
+        """(M, 2) int array of (edge index, face index) pairs of the
+        template, as in Shape.edge_faces. Computed on first use and
+        cached."""
+        if self._edge_faces is None:
+            self._edge_faces = edge_face_pairs(self.edges, self.faces)
+        return self._edge_faces
+
+    def triangles(self):
+        """(N_triangles, 3) int array fan-triangulating the template faces."""
+        if self.faces is None:
+            return np.zeros((0, 3), dtype=np.intp)
+        return fan_triangles(self.faces)
+
+    def all_edges(self):
+        """Edges of every instance, indexing into the rows of "pos"."""
+        return tile_indices(self.edges, self.count, len(self.base_pos))
+
+    def all_faces(self):
+        """Faces of every instance, indexing into the rows of "pos"."""
+        if self.faces is None:
+            return None
+        return tile_indices(self.faces, self.count, len(self.base_pos))
+
+    def all_triangles(self):
+        """Triangles of every instance, indexing into the rows of "pos"."""
+        return tile_indices(self.triangles(), self.count, len(self.base_pos))
+
+    def all_edge_faces(self):
+        """edge_faces pairs of every instance, indexing into all_edges and
+        all_faces."""
+        n_faces = 0 if self.faces is None else len(self.faces)
+        return tile_indices(
+            self.edge_faces(), self.count, [len(self.edges), n_faces]
+        )
@@ -0,0 +1,174 @@
+from contextlib import contextmanager, nullcontext
+import functools
+import json
+import numpy as np
+import threading
+import time
+import tracemalloc
+
+
+# Profiler that stage() and timed() report into, set by Profiler.activate
+ACTIVE = None
+
+
+class Profiler:
+    """Profiler collects named stage timings. Code reports into the active
+    profiler through the module-level "stage" context manager and "timed"
+    decorator, which cost next to nothing while no profiler is active; Grid,
+    grid_utils, shape_lib and Animation are instrumented this way. Stages
+    may nest, and each is timed including its sub-stages.
+
+    If "memory", tracemalloc is started and every stage also records its
+    peak traced memory above what was allocated when it began. Tracing
+    slows everything down noticeably, so timings taken with it on should
+    only be compared with each other. Stages nest per thread, but tracemalloc
+    tracks a single peak for the whole process, so peaks are only reliable
+    while one thread at a time runs stages: memory capture is not supported
+    with Animation's pipeline mode.
+
+    summary gives per-stage call counts, p50, p95 and total seconds, plus
+    frames per second over the frames counted with tick; report formats it
+    as a table and dump writes it as JSON."""
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.times = {}
+        self.peaks = {}
+        self.frames = 0
+        self.elapsed = 0.0
+        self._since = None
+        self._local = threading.local()
+
+    def activate(self):
+        global ACTIVE
+        ACTIVE = self
+        self._since = time.perf_counter()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return self
+
+    def deactivate(self):
+        global ACTIVE
+        if ACTIVE is self:
+            ACTIVE = None
+        if self._since is not None:
+            self.elapsed += time.perf_counter() - self._since
+            self._since = None
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def __enter__(self):
+        return self.activate()
+
+    def __exit__(self, *exc):
+        self.deactivate()
+
+    @property
+    def _stack(self):
+        """Stack of [base, peak] memory of the open stages of this thread."""
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block as one call of stage "name"."""
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            self._stack.append([current, current])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+            if self.memory:
+                base, peak = self._stack.pop()
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                self.peaks[name] = max(self.peaks.get(name, 0), peak - base)
+                if self._stack:
+                    self._stack[-1][1] = max(self._stack[-1][1], peak)
+
+    def record(self, name, seconds):
+        """Adds a call of stage "name" that took "seconds"."""
+        self.times.setdefault(name, []).append(seconds)
+
+    def tick(self, count=1):
+        """Counts finished frames for the frames-per-second figure."""
+        self.frames += count
+
+    def summary(self):
+        """Returns a dict of per-stage statistics and overall throughput,
+        over the time the profiler has been active."""
+        elapsed = self.elapsed
+        if self._since is not None:
+            elapsed += time.perf_counter() - self._since
+        stages = {}
+        for name, times in self.times.items():
+            times = np.asarray(times)
+            stages[name] = {
+                "count":len(times),
+                "p50":float(np.percentile(times, 50)),
+                "p95":float(np.percentile(times, 95)),
+                "total":float(times.sum())
+            }
+            if name in self.peaks:
+                stages[name]["peak_bytes"] = int(self.peaks[name])
+        return {
+            "stages":stages,
+            "frames":self.frames,
+            "elapsed":elapsed,
+            "fps":self.frames / elapsed if elapsed > 0 else 0.0
+        }
+
+    def report(self):
+        """Returns the summary as a table, stages sorted by total time."""
+        summary = self.summary()
+        header = (
+            f"{'stage':<20}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}"
+            f"{'total s':>10}"
+        )
+        if self.memory:
+            header += f"{'peak MB':>10}"
+        lines = [header, "-" * len(header)]
+        stages = sorted(
+            summary["stages"].items(), key=lambda item: -item[1]["total"]
+        )
+        for name, st in stages:
+            line = (
+                f"{name:<20}{st['count']:>8}{1e3*st['p50']:>10.2f}"
+                f"{1e3*st['p95']:>10.2f}{st['total']:>10.3f}"
+            )
+            if self.memory:
+                line += f"{st.get('peak_bytes', 0)/1e6:>10.1f}"
+            lines.append(line)
+        lines.append(
+            f"{summary['frames']} frames in {summary['elapsed']:.2f}s"
+            f" ({summary['fps']:.2f} frames/s)"
+        )
+        return "\n".join(lines)
+
+    def dump(self, fname):
+        """Writes the summary to the JSON file fname."""
+        with open(fname, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def stage(name):
+    """Context manager timing the enclosed block as stage "name" of the
+    active Profiler, or doing nothing if there is none."""
+    return nullcontext() if ACTIVE is None else ACTIVE.stage(name)
+
+def timed(name):
+    """Decorator reporting every call of the function as stage "name"."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if ACTIVE is None:
+                return func(*args, **kwargs)
+            with ACTIVE.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,112 @@
+import numpy as np
+
+from shape_utils import affine_matrix, apply_affine, rotation_matrix
+
+
+class SceneNode:
+    """SceneNode groups Shapes, InstancedShapes and other SceneNodes under a
+    common 4x4 homogeneous transform "matrix", expressed in the coordinates
+    of the node's parent. A shape hanging under a node is drawn at
+    world() @ shape.matrix, so moving a node moves its whole subtree with a
+    single matrix update.
+
+    World matrices are computed on first use and cached. A transform
+    invalidates the caches of the node's own subtree only, and bumps the
+    "stamp" of every node in it so that renderers can tell which shapes
+    moved."""
+
+    def __init__(self, name, children=None, matrix=None):
+        self.name = name
+        self.parent = None
+        self.children = []
+        self.matrix = np.eye(4) if matrix is None else np.asarray(matrix)
+        self.stamp = 0
+        self._world = None
+        for child in children or []:
+            self.add(child)
+
+    def add(self, child):
+        """Hang a shape or node under self, detaching it from its previous
+        parent."""
+        if child.parent is not None:
+            child.parent.remove(child)
+        child.parent = self
+        self.children.append(child)
+        if isinstance(child, SceneNode):
+            child._invalidate()
+        return child
+
+    def remove(self, child):
+        self.children.remove(child)
+        child.parent = None
+        if isinstance(child, SceneNode):
+            child._invalidate()
+
+    def nodes(self):
+        """Yields self and every SceneNode below it, parents first."""
+        yield self
+        for child in self.children:
+            if isinstance(child, SceneNode):
+                yield from child.nodes()
+
+    def shapes(self):
+        """List of all shapes in the subtree of self."""
+        return [
+            child for node in self.nodes() for child in node.children
+            if not isinstance(child, SceneNode)
+        ]
+
+    def world(self):
+        """4x4 matrix taking the coordinates of self to world coordinates."""
+        if self._world is None:
+            self._world = (
+                self.matrix if self.parent is None
+                else self.parent.world() @ self.matrix
+            )
+        return self._world
+
+    def _invalidate(self):
+        for node in self.nodes():
+            node._world = None
+            node.stamp += 1
+
+    def transform(self, mat):
+        """Compose the 4x4 homogeneous matrix "mat", given in the parent's
+        coordinates, into self.matrix."""
+        self.matrix = mat @ self.matrix
+        self._invalidate()
+        return self
+
+    def translate(self, direction):
+        self.transform(affine_matrix(offset=direction))
+
+    def scale(self, factor, center="com"):
+        assert factor >= 0, "factor must be non-negative"
+
+        center = self._pivot(center)
+        self.transform(affine_matrix(linear=factor*np.eye(3), center=center))
+
+    def rotate_3d(self, axis, angle, center="com"):
+        center = self._pivot(center)
+        rot = rotation_matrix(axis, angle)
+        self.transform(affine_matrix(linear=rot, center=center))
+
+    def _pivot(self, center):
+        """Returns "center", or the world-space center of mass of the subtree
+        if it is "com", in the coordinates of the parent."""
+        if not isinstance(center, str):
+            return np.asarray(center)
+        center = self.get_com()
+        if self.parent is not None:
+            center = apply_affine(center, np.linalg.inv(self.parent.world()))
+        return center
+
+    def get_com(self):
+        """World-space mean of the centers of mass of the shapes in the
+        subtree of self."""
+        shapes = self.shapes()
+        coms = np.zeros((len(shapes), 3))
+        for row, shp in zip(coms, shapes):
+            com = shp.world_com()
+            row[:len(com)] = com
+        return coms.mean(axis=0)
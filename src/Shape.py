@@ -1,68 +1,187 @@
 import networkx as nx
 import numpy as np
 
-from shape_utils import center_of_mass, rotate_point_2d, rotation_matrix
+from shape_utils import (
+    affine_matrix,
+    apply_affine,
+    edge_face_pairs,
+    fan_triangles,
+    rotation_matrix,
+    rotation_matrix_2d
+)
 
 
-class Shape(nx.Graph):
+class Shape:
+    """Shape stores a wireframe as one contiguous (N, dims) float array of
+    vertex positions, "pos", and an (N_edges, 2) int array of vertex indices,
+    "edges". Optional "faces" is an (N_faces, k) int array of polygons,
+    wound counterclockwise seen from outside; if "fill" is set, the faces are
+    filled with that shade when drawn. Transforms act on all vertices at
+    once; an nx.Graph view is available through to_nx for graph queries.
 
-    def __init__(self, name, shade=1, dims=2):
-        super().__init__()
+    Transforms are not applied to the vertices right away. Each call composes
+    into a pending 4x4 homogeneous "matrix", and the vertices are rewritten
+    once, when "pos" is read or apply is called. "version" is incremented by
+    every change to the shape's geometry or shade, so that renderers can
+    tell which shapes moved since they were last drawn.
+
+    A Shape added to a SceneNode is drawn in the coordinates of that node:
+    "pos" and the transforms stay local, and world_pos, world_matrix and
+    world_com include the node's world matrix."""
+
+    def __init__(
+        self,
+        name,
+        shade=1,
+        dims=2,
+        pos=None,
+        edges=None,
+        faces=None,
+        fill=None
+    ):
+        self.version = 0
         self.name = name
         self.shade = shade
         self.dims = dims
+        self.pos = (
+            np.zeros((0, dims))
+            if pos is None
+            else np.asarray(pos, dtype=float).reshape(-1, dims)
+        )
+        self.edges = (
+            np.zeros((0, 2), dtype=np.intp)
+            if edges is None
+            else np.asarray(edges, dtype=np.intp).reshape(-1, 2)
+        )
+        self.faces = (
+            None if faces is None else np.asarray(faces, dtype=np.intp)
+        )
+        self.fill = fill
+        self.parent = None
+        self._edge_faces = None
         self.com = None
 
     @classmethod
     def from_nx(cls, graph, **kwargs):
-        shape = cls(**kwargs)
-        shape.add_nodes_from([(i, graph.nodes[i]) for i in graph.nodes])
-        shape.add_edges_from(list(graph.edges))
-        return shape
+        """Create a Shape from an nx.Graph whose nodes carry a "pos" attribute.
+        Nodes are renumbered 0..N-1 in the graph's iteration order."""
+        index = {node:i for i, node in enumerate(graph.nodes)}
+        pos = [graph.nodes[node]["pos"] for node in graph.nodes]
+        edges = [(index[u], index[v]) for u, v in graph.edges]
+        return cls(pos=pos, edges=edges, **kwargs)
+
+    def to_nx(self):
+        """Return an nx.Graph view of self with "pos" node attributes."""
+        graph = nx.Graph()
+        graph.add_nodes_from([
+            (i, {"pos":point}) for i, point in enumerate(self.pos)
+        ])
+        graph.add_edges_from([tuple(edge) for edge in self.edges.tolist()])
+        return graph
+
+    @property
+    def pos(self):
+        """(N, dims) array of vertex positions with pending transforms
+        applied."""
+        self.apply()
+        return self._pos
+
+    @pos.setter
+    def pos(self, pos):
+        self._pos = np.asarray(pos, dtype=float)
+        self._base_com = None
+        self.version += 1
+        self.matrix = np.eye(4)
+        self._pending = False
+
+    @property
+    def base_pos(self):
+        """(N, dims) array of vertex positions before the pending transform
+        "matrix" is applied."""
+        return self._pos
+
+    def apply(self):
+        """Apply the pending transform to the vertices and reset it."""
+        if self._pending:
+            self._pos = apply_affine(self._pos, self.matrix)
+            if self._base_com is not None:
+                self._base_com = apply_affine(self._base_com, self.matrix)
+            self.matrix = np.eye(4)
+            self._pending = False
+        return self
+
+    def transform(self, mat):
+        """Compose the 4x4 homogeneous matrix "mat" into the pending
+        transform."""
+        self.matrix = mat @ self.matrix
+        self._pending = True
+        self.version += 1
+        return self
 
     def set_shade(self, shade):
         self.shade = shade
-        
+        self.version += 1
+
+    def set_fill(self, fill):
+        """Set the shade used to fill faces, or None to draw edges only."""
+        self.fill = fill
+        self.version += 1
+
+    def edge_faces(self):
+        """(M, 2) int array of (edge index, face index) pairs, one for every
+        face bordering each edge, matched on unordered vertex pairs. Computed
+        on first use and cached."""
+        if self._edge_faces is None:
+            self._edge_faces = edge_face_pairs(self.edges, self.faces)
+        return self._edge_faces
+
+    def triangles(self):
+        """(N_triangles, 3) int array fan-triangulating self.faces."""
+        if self.faces is None:
+            return np.zeros((0, 3), dtype=np.intp)
+        return fan_triangles(self.faces)
+
     def translate(self, direction):
-        for node in list(self.nodes):
-            direction = np.array(direction)
-            point = np.array(self.nodes[node]["pos"])
-            self.nodes[node]["pos"] = point + direction
-    
+        self.transform(affine_matrix(offset=direction))
+
     def scale(self, factor, center = "com"):
         assert factor >= 0, "factor must be non-negative"
 
-        center = (
-            center_of_mass(self, dims=self.dims)
-            if center == "com"
-            else np.asarray(center)
-        )
-        for node in list(self.nodes):
-            point = np.array(self.nodes[node]["pos"])
-            outward_radial = point - center
-            self.nodes[node]["pos"] = center + factor * outward_radial
-    
+        center = self.get_com() if center == "com" else np.asarray(center)
+        self.transform(affine_matrix(linear=factor*np.eye(3), center=center))
+
     def rotate_2d(self, origin, angle):
-        for node in list(self.nodes):
-            self.nodes[node]["pos"] = rotate_point_2d(
-                origin = origin,
-                point = self.nodes[node]["pos"],
-                angle = angle
-            )
-        return self
-            
+        rot = rotation_matrix_2d(angle)
+        return self.transform(affine_matrix(linear=rot, center=origin))
+
     def rotate_3d(self, axis, angle, center="com"):
-        center = (
-            center_of_mass(self, dims=self.dims)
-            if center == "com"
-            else np.asarray(center)
-        )
+        center = self.get_com() if center == "com" else np.asarray(center)
         rot = rotation_matrix(axis, angle)
-        for node in list(self.nodes):
-            point = np.array(self.nodes[node]["pos"])
-            trans_pt = point - center
-            self.nodes[node]["pos"] = np.dot(rot, trans_pt) + center
-    
+        self.transform(affine_matrix(linear=rot, center=center))
+
+    def world_matrix(self):
+        """Pending transform composed with the world matrix of the SceneNode
+        self hangs under, if any."""
+        if self.parent is None:
+            return self.matrix
+        return self.parent.world() @ self.matrix
+
+    def world_pos(self):
+        """(N, dims) array of vertex positions in world coordinates."""
+        if self.parent is None:
+            return self.pos
+        return apply_affine(self.pos, self.parent.world())
+
+    def world_com(self):
+        """Center of mass of the vertices in world coordinates."""
+        if self.parent is None:
+            return self.get_com()
+        return apply_affine(self.get_com(), self.parent.world())
+
     def get_com(self):
-        """Get dims-dimensional center of mass of vertices in self"""
-        return center_of_mass(self, self.dims)
+        """Get dims-dimensional center of mass of vertices in self. Affine maps
+        preserve the mean, so this is O(1) once the untransformed center of
+        mass is known."""
+        if self._base_com is None:
+            self._base_com = self._pos[:, :self.dims].mean(axis=0)
+        return apply_affine(self._base_com, self.matrix)
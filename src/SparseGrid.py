@@ -0,0 +1,151 @@
+import numpy as np
+
+from Camera import Camera
+from Grid import Grid, _state
+from grid_utils import *
+from Profiler import timed
+
+
+class SparseGrid(Grid):
+    """SparseGrid draws wireframes without a dense grid. For every shape it
+    keeps the list of pixels its edges cover, as sorted flat pixel indices
+    "pix" (row * dim[1] + col) and the shade each ends up with, and only
+    shapes that changed since the last draw are rasterized again. The
+    painted canvas is composited under the pixel lists only on export:
+    to_image colors the pixels over a cached image of the background, and
+    composite builds the dense array that Grid would hold in gridarr.
+
+    frame_diff gives the pixels whose shade changed between the last two
+    draws, computed from the pixel lists alone. Shapes with a "fill" shade
+    are not supported."""
+
+    def __init__(self, shapes, dim, zerobottomleft=True, dtype="float64"):
+        super().__init__(
+            shapes, dim, zerobottomleft=zerobottomleft, dtype=dtype
+        )
+        self.pixels = {}
+        self._painted = False
+        self._order = []
+        self._resolved = None
+        self._previous = self.resolve()
+        self._background = None
+
+    def _buffer(self, name):
+        return None
+
+    @timed("paint_canvas")
+    def paint_canvas(self, paint="white"):
+        self._check_paint(paint)
+        self.gridcur = paint
+        self._painted = True
+        self._background = None
+        self._resolved = None
+
+    @timed("draw_shapes")
+    def draw_shapes(self, shapes="all", proj="persp", hidden=False):
+        """Updates the pixel lists of shapes that changed; see
+        Grid.draw_shapes."""
+        names = [name for name in self.shapes] if shapes=="all" else shapes
+        previous = self.resolve()
+        camera = Camera.from_proj(proj)
+        view = (
+            shapes if shapes=="all" else tuple(shapes), camera.key(), hidden
+        )
+        if view != self._drawn_view:
+            self.pixels, self._drawn_view = {}, view
+
+        changed = [
+            name for name in names
+            if name in self.dirty
+            or name not in self.pixels
+            or self.pixels[name]["state"] != _state(self.shapes[name])
+        ]
+        for name, rec in self._project(changed, camera, hidden).items():
+            assert not len(rec["tris"]), "SparseGrid draws wireframes only"
+            rows, cols, shades = edge_pixels(
+                rec["starts"], rec["ends"], self.dim, rec["shades"]
+            )
+            pix, shades = last_writes(
+                rows * self.dim[1] + cols, quantize(shades, self.dtype)
+            )
+            self.pixels[name] = {
+                "pix":pix, "shades":shades, "state":rec["state"]
+            }
+        for name in set(self.pixels) - set(names):
+            del self.pixels[name]
+        self.dirty.clear()
+
+        self._previous = previous
+        self._order = names
+        self._resolved = None
+
+    def resolve(self):
+        """Returns the (pix, shades) pixel list of all shapes drawn, later
+        shapes covering earlier ones."""
+        if self._resolved is None:
+            recs = [self.pixels[name] for name in self._order]
+            if recs:
+                self._resolved = last_writes(
+                    np.concatenate([rec["pix"] for rec in recs]),
+                    np.concatenate([rec["shades"] for rec in recs])
+                )
+            else:
+                self._resolved = (
+                    np.zeros(0, dtype=np.intp), np.zeros(0, dtype=self.dtype)
+                )
+        return self._resolved
+
+    def frame_diff(self):
+        """Returns (rows, cols, shades) for the pixels whose shade changed
+        between the last two draws. Pixels no shape covers any more get
+        their background shade."""
+        new_pix, new_shades = self.resolve()
+        old_pix, old_shades = self._previous
+        same = np.zeros(len(new_pix), dtype=bool)
+        if len(old_pix):
+            pos = np.searchsorted(old_pix, new_pix).clip(0, len(old_pix)-1)
+            same = (old_pix[pos] == new_pix) & (old_shades[pos] == new_shades)
+        gone = old_pix[~np.isin(old_pix, new_pix)]
+        pix = np.concatenate([new_pix[~same], gone])
+        shades = np.concatenate([
+            new_shades[~same], self.background().ravel()[gone]
+        ])
+        return pix // self.dim[1], pix % self.dim[1], shades
+
+    def background(self):
+        """The read-only canvas the pixel lists are composited over."""
+        dim = tuple(int(d) for d in self.dim)
+        if not self._painted:
+            return np.zeros(dim, dtype=self.dtype)
+        return painted_canvas(self.gridcur, dim, self.dtype.str)
+
+    def composite(self):
+        """Returns the dense array of shades: the canvas with every pixel
+        list drawn over it."""
+        out = np.array(self.background())
+        pix, shades = self.resolve()
+        out.ravel()[pix] = shades
+        return out
+
+    def to_image(self, cmap="Greys", size=None, out=None):
+        """Returns the grid as a BGR uint8 image, as Grid.to_image does. The
+        colormapped background is cached, so each call copies it and colors
+        only the pixels in the pixel lists."""
+        key = (self.gridcur, self._painted, cmap, size)
+        if self._background is None or self._background[0] != key:
+            bg = self.background()
+            bgout = np.rot90(bg) if self.zerobottomleft else bg
+            self._background = (key, shade_to_image(bgout, cmap, size))
+        image = self._background[1]
+        if out is None:
+            out = image.copy()
+        else:
+            np.copyto(out, image)
+
+        pix, shades = self.resolve()
+        rows, cols = pix // self.dim[1], pix % self.dim[1]
+        shape = tuple(int(d) for d in self.dim)
+        if self.zerobottomleft:
+            rows, cols, shape = shape[1] - 1 - cols, rows, shape[::-1]
+        colors = shade_to_image(shades[None, :], cmap)[0]
+        return scatter_image(out, rows, cols, colors, shape)
@@ -0,0 +1,193 @@
+import cv2
+import numpy as np
+import os
+import shutil
+import tempfile
+
+from Camera import Camera
+from Grid import Grid
+from grid_utils import *
+from Profiler import timed
+
+
+class TiledGrid(Grid):
+    """TiledGrid renders grids too large to hold in memory. canvas and
+    gridarr are .npy files in the directory "path" (a new temporary
+    directory by default), opened as memory maps, and all work is done one
+    tile of size "tile" = (rows, cols) at a time: the canvas is painted per
+    tile, edges and faces are binned to the tiles their bounding boxes
+    overlap, and each tile is rasterized in memory and written back.
+    write_tiles and write_image colormap gridarr tile by tile, so the working
+    set stays at a few tiles however large the grid.
+
+    Every draw_shapes call redraws the whole grid; the result is the same
+    as drawing onto a Grid of the same size.
+
+    close releases the memory maps and, if TiledGrid created "path" itself,
+    deletes it with the arrays in it; using TiledGrid as a context manager
+    closes it on exit."""
+
+    def __init__(
+        self,
+        shapes,
+        dim,
+        tile=(2048, 2048),
+        path=None,
+        zerobottomleft=True,
+        dtype="uint8"
+    ):
+        self.tile = tuple(tile)
+        self._owns_path = path is None
+        self.path = path if path is not None else tempfile.mkdtemp()
+        os.makedirs(self.path, exist_ok=True)
+        super().__init__(
+            shapes, dim, zerobottomleft=zerobottomleft, dtype=dtype
+        )
+
+    def _buffer(self, name):
+        return np.lib.format.open_memmap(
+            os.path.join(self.path, name + ".npy"),
+            mode="w+",
+            dtype=self.dtype,
+            shape=tuple(int(d) for d in self.dim)
+        )
+
+    def close(self):
+        """Flushes and releases canvas and gridarr, and deletes "path" if it
+        was created by self."""
+        for name in ("canvas", "gridarr"):
+            arr = getattr(self, name, None)
+            if arr is not None:
+                arr.flush()
+                setattr(self, name, None)
+        if self._owns_path:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self._owns_path = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def tiles(self):
+        """Yields ((i, j), (row0, row1, col0, col1)) for every tile, row by
+        row."""
+        (rows, cols), (h, w) = self.dim, self.tile
+        for i, r0 in enumerate(range(0, rows, h)):
+            for j, c0 in enumerate(range(0, cols, w)):
+                yield (i, j), (r0, min(r0 + h, rows), c0, min(c0 + w, cols))
+
+    @timed("paint_canvas")
+    def paint_canvas(self, paint="white"):
+        self._check_paint(paint)
+        for _, (r0, r1, c0, c1) in self.tiles():
+            self.canvas[r0:r1, c0:c1] = paint_window(
+                paint, self.dim, (r0, r1, c0, c1), self.dtype
+            )
+        self.canvas.flush()
+        self.gridcur = paint
+        self._drawn = None
+
+    @timed("draw_shapes")
+    def draw_shapes(self, shapes="all", proj="persp", hidden=False):
+        """Draws shapes over the canvas into gridarr tile by tile; see
+        Grid.draw_shapes."""
+        names = [name for name in self.shapes] if shapes=="all" else shapes
+        records = list(
+            self._project(names, Camera.from_proj(proj), hidden).values()
+        )
+        self._drawn = None
+        self.dirty.clear()
+        if not records:
+            for _, (r0, r1, c0, c1) in self.tiles():
+                self.gridarr[r0:r1, c0:c1] = self.canvas[r0:r1, c0:c1]
+            self.gridarr.flush()
+            return
+
+        starts = np.concatenate([rec["starts"] for rec in records])
+        ends = np.concatenate([rec["ends"] for rec in records])
+        shades = np.concatenate([rec["shades"] for rec in records])
+        edge_depths = np.concatenate([rec["depths"] for rec in records])
+        tris = np.concatenate([rec["tris"] for rec in records])
+        depths = np.concatenate([rec["tri_depths"] for rec in records])
+        fills = np.concatenate([rec["fills"] for rec in records])
+
+        edge_bins = tile_bins(
+            segment_bboxes(starts, ends, self.dim), self.tile
+        )
+        # faces are drawn with a margin of one pixel around each tile, so
+        # that edges are depth-tested as they would be on a whole Grid
+        tri_bins = tile_bins(
+            segment_bboxes(
+                tris.min(axis=1) - 1, tris.max(axis=1) + 1, self.dim
+            ),
+            self.tile
+        )
+
+        for idx, (r0, r1, c0, c1) in self.tiles():
+            p0, q0 = max(r0 - 1, 0), max(c0 - 1, 0)
+            p1, q1 = min(r1 + 1, self.dim[0]), min(c1 + 1, self.dim[1])
+            buf = np.array(self.canvas[p0:p1, q0:q1])
+            window = dict(
+                dim=self.dim, clip=[(p0, p1, q0, q1)], origin=(p0, q0)
+            )
+            zbuf = None
+            if idx in tri_bins:
+                sel = tri_bins[idx]
+                zbuf = np.full(buf.shape, np.inf)
+                draw_faces(
+                    buf,
+                    tris[sel],
+                    shades=fills[sel],
+                    depths=depths[sel],
+                    zbuf=zbuf,
+                    **window
+                )
+            if idx in edge_bins:
+                sel = edge_bins[idx]
+                draw_edges(
+                    buf,
+                    starts[sel],
+                    ends[sel],
+                    shades=shades[sel],
+                    depths=edge_depths[sel],
+                    zbuf=zbuf,
+                    **window
+                )
+            self.gridarr[r0:r1, c0:c1] = buf[r0-p0:r1-p0, c0-q0:c1-q0]
+        self.gridarr.flush()
+
+    def _image_tiles(self, cmap):
+        """Yields ((row0, col0), image) for every tile of gridarr, where
+        image is the tile's BGR uint8 image and (row0, col0) its position in
+        the image of the whole grid, oriented as in to_image."""
+        for _, (r0, r1, c0, c1) in self.tiles():
+            arr = self.gridarr[r0:r1, c0:c1]
+            if self.zerobottomleft:
+                arr, pos = np.rot90(arr), (int(self.dim[1]) - c1, r0)
+            else:
+                pos = (r0, c0)
+            yield pos, shade_to_image(arr, cmap=cmap)
+
+    @timed("write_tiles")
+    def write_tiles(self, directory, cmap="Greys", ext="png"):
+        """Writes every tile as the image file tile_<row0>_<col0>.<ext> in
+        "directory", named by its top-left pixel in the whole image."""
+        os.makedirs(directory, exist_ok=True)
+        for (row, col), image in self._image_tiles(cmap):
+            fname = os.path.join(directory, f"tile_{row}_{col}.{ext}")
+            cv2.imwrite(fname, image)
+
+    @timed("write_image")
+    def write_image(self, filename, cmap="Greys"):
+        """Writes the whole image as a (height, width, 3) BGR uint8 .npy file,
+        filled in tile by tile through a memory map."""
+        rows, cols = (int(d) for d in self.dim)
+        height, width = (cols, rows) if self.zerobottomleft else (rows, cols)
+        out = np.lib.format.open_memmap(
+            filename, mode="w+", dtype=np.uint8, shape=(height, width, 3)
+        )
+        for (row, col), image in self._image_tiles(cmap):
+            out[row:row + image.shape[0], col:col + image.shape[1]] = image
+        out.flush()
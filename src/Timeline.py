@@ -0,0 +1,152 @@
+import numpy as np
+import zlib
+
+from InstancedShape import InstancedShape
+from shape_utils import affine_matrix, rotation_matrix
+
+
+class Track:
+    """Track is one animated value as a function of time: either "keys", a
+    dict mapping times to values (scalars or equal-length vectors), which
+    are interpolated linearly and held constant before the first and after
+    the last, or a function of t. Functions must be defined at module level
+    for frames to be rendered in worker processes, and cannot be hashed into
+    frame keys, so a cache_key has to be given for them."""
+
+    def __init__(self, keys):
+        if callable(keys):
+            self.func, self.times, self.values = keys, None, None
+            return
+        times = sorted(keys)
+        self.func = None
+        self.times = np.asarray(times, dtype=float)
+        self.values = np.stack([
+            np.atleast_1d(np.asarray(keys[t], dtype=float)) for t in times
+        ])
+
+    def value(self, t):
+        if self.func is not None:
+            return self.func(t)
+        value = np.array([
+            np.interp(t, self.times, col) for col in self.values.T
+        ])
+        return value if self.values.shape[1] > 1 else value[0]
+
+    def params(self):
+        """The keyframes (or function) defining self, for frame keys."""
+        if self.func is not None:
+            return self.func
+        return (self.times, self.values)
+
+
+class Timeline:
+    """Timeline animates shapes as a pure function of time. Each shape has
+    up to four tracks: "position", an offset from where the shape rests;
+    "rotation", an (axis, angle) pair turning it about its center of mass;
+    "scale", a factor about its center of mass; and "shade". pose sets every
+    animated shape of a Grid to its state at t starting from the shape's rest
+    pose, captured the first time it is posed, so frames can be computed in
+    any order, in parallel or one at a time (see Animation.from_timeline).
+
+    Rotation keys are interpolated component by component, angle included,
+    and the axis renormalized. Randomness should come from rng, whose
+    streams depend only on "seed" and the names they are drawn for."""
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.tracks = {}
+        self._rest = {}
+
+    def rng(self, *names):
+        """np.random.Generator seeded by "seed" and "names" alone, so the
+        same names always draw the same numbers, in any process and in
+        whatever order streams are created."""
+        salt = [zlib.crc32(str(name).encode()) for name in names]
+        return np.random.default_rng([self.seed] + salt)
+
+    def animate(
+        self, name, position=None, rotation=None, scale=None, shade=None
+    ):
+        """Sets the tracks of shape "name". Each is a dict of keyframes or a
+        function of t, as in Track; rotation values are (axis, angle)."""
+        if isinstance(rotation, dict):
+            rotation = {
+                t:np.append(axis, angle)
+                for t, (axis, angle) in rotation.items()
+            }
+        channels = {
+            "position":position,
+            "rotation":rotation,
+            "scale":scale,
+            "shade":shade
+        }
+        self.tracks[name] = {
+            key:Track(keys) for key, keys in channels.items()
+            if keys is not None
+        }
+        return self
+
+    def state(self, name, t):
+        """Dict of the values of the tracks of shape "name" at time t."""
+        return {key:track.value(t) for key, track in self.tracks[name].items()}
+
+    def matrix(self, name, t, center=(0, 0, 0)):
+        """4x4 homogeneous matrix taking shape "name" from rest to time t,
+        rotating and scaling about "center"."""
+        state = self.state(name, t)
+        linear = np.eye(3)
+        if "rotation" in state:
+            rotation = state["rotation"]
+            if self.tracks[name]["rotation"].func is None:
+                rotation = (rotation[:3], rotation[3])
+            linear = rotation_matrix(*rotation)
+        if "scale" in state:
+            linear = state["scale"] * linear
+        return affine_matrix(
+            linear=linear, center=center, offset=state.get("position")
+        )
+
+    def pose(self, grid, t):
+        """Puts every animated shape of "grid" in its state at time t."""
+        for name in self.tracks:
+            if name not in grid.shapes:
+                continue
+            shp = grid.shapes[name]
+            rest = self._rest_pose(shp)
+            mat = self.matrix(name, t, center=rest["com"])
+            if isinstance(shp, InstancedShape):
+                shp.set_transforms(mat @ rest["pos"])
+            else:
+                shp.pos = rest["pos"]
+                shp.transform(mat)
+            if "shade" in self.tracks[name]:
+                shade = self.tracks[name]["shade"].value(t)
+                if isinstance(shp, InstancedShape):
+                    shp.set_shades(shade)
+                else:
+                    shp.set_shade(shade)
+            grid.dirty.add(name)
+
+    def _rest_pose(self, shp):
+        """Returns the rest pose of shp, capturing it on first use: its
+        vertices (per-instance matrices for an InstancedShape) and center of
+        mass."""
+        rest = self._rest.get(shp.name)
+        if rest is None or rest["shape"] is not shp:
+            if isinstance(shp, InstancedShape):
+                pos = np.array(shp.transforms)
+            else:
+                pos = np.array(shp.pos)
+            rest = {"shape":shp, "pos":pos, "com":shp.get_com()}
+            self._rest[shp.name] = rest
+        return rest
+
+    def params(self):
+        """The seed and every track's keyframes, for frame keys."""
+        return {
+            "seed":self.seed,
+            "tracks":{
+                name:{key:track.params() for key, track in tracks.items()}
+                for name, tracks in self.tracks.items()
+            }
+        }
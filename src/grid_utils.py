@@ -1,20 +1,47 @@
-import math
+from collections import OrderedDict
+import functools
 import matplotlib.cm as cm
 from matplotlib.colors import LinearSegmentedColormap
+import matplotlib.pyplot as plt
 import numpy as np
 
-from shape_utils import center_of_mass
+from Camera import Camera
+from Profiler import timed
+from shape_utils import fan_triangles
 
 
-def rgb_to_cmap(colors, penlow=None, penhigh=None):
+# Lookup tables built by cmap_lut and rgb_to_cmap, keyed by colormap name or
+# by id of the colormap object (which is kept alongside so that the id cannot
+# be reused)
+LUTS = {}
+
+# Canvases built by painted_canvas, keyed by (paint, dim, dtype) and ordered
+# from least to most recently used; older ones are dropped once they add up
+# to more than CANVAS_CACHE_BYTES
+CANVASES = OrderedDict()
+CANVAS_CACHE_BYTES = 2**29
+
+
+def rgb_to_cmap(colors, penlow=None, penhigh=None, lut_size=4096):
     """Returns a matplotlib.cm object that evenly spaces `colors` and includes
     optional 'pen' colors at shades [0,0.001) and (0.999, 1] of the cmap.
 
+    Colormaps are memoized on their arguments, so repeated calls return the
+    same object. An exact lookup table of lut_size entries (see rgb_to_lut)
+    is registered for each one and used by cmap_lut in place of sampling the
+    colormap.
+
     Args:
         colors: a list of colors in RGB format, i.e. from 0-255
         penlow: an RGB color specifying the color of 'pen' at shade 0
-        penlow: an RGB color specifying the color of 'pen' at shade 1
+        penhigh: an RGB color specifying the color of 'pen' at shade 1
+        lut_size: number of entries in the registered lookup table
     """
+    return _rgb_to_cmap(*_color_key(colors, penlow, penhigh), lut_size)
+
+@functools.lru_cache(maxsize=64)
+def _rgb_to_cmap(colors, penlow, penhigh, lut_size):
+    lut = _rgb_to_lut(colors, penlow, penhigh, lut_size)
     colors = np.asarray(colors) / 255
     penlow = np.asarray(penlow) / 255 if penlow is not None else None
     penhigh = np.asarray(penhigh) / 255 if penhigh is not None else None
@@ -60,62 +87,638 @@ def rgb_to_cmap(colors, penlow=None, penhigh=None):
         "green":tuple(tuple(x) for x in green),
         "blue":tuple(tuple(x) for x in blue)
     }
-    return LinearSegmentedColormap("custom", cdict)
+    cmap = LinearSegmentedColormap("custom", cdict)
+    LUTS[id(cmap)] = (cmap, np.ascontiguousarray(lut[:, ::-1]))
+    return cmap
+
+def rgb_to_lut(colors, penlow=None, penhigh=None, size=4096):
+    """Returns the colormap of rgb_to_cmap as a read-only (size, 3) uint8 RGB
+    lookup table, indexed by floor(shade * size) as in shade_to_image. Entry
+    i holds the color at the center of its bin, except that the pen bands are
+    kept exact: bins centered in [0, 0.001) are penlow and bins centered in
+    (0.999, 1] are penhigh, and shades 0 and 1 always map to the pens
+    whatever the size. Tables are memoized on their arguments."""
+    return _rgb_to_lut(*_color_key(colors, penlow, penhigh), size)
+
+@functools.lru_cache(maxsize=64)
+def _rgb_to_lut(colors, penlow, penhigh, size):
+    colors = np.asarray(colors)
+    low = 0 if penlow is None else 0.001
+    high = 1 if penhigh is None else 0.999
+    anchors = np.linspace(low, high, num=len(colors))
+    centers = (np.arange(size) + 0.5) / size
+    lut = np.stack([
+        np.interp(centers, anchors, colors[:, i]) for i in range(3)
+    ], axis=1)
+
+    if penlow is not None:
+        lut[(centers < low) | (np.arange(size) == 0)] = penlow
+    if penhigh is not None:
+        lut[(centers > high) | (np.arange(size) == size-1)] = penhigh
+
+    lut = np.rint(lut).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+def _color_key(colors, penlow, penhigh):
+    """Hashable form of rgb_to_cmap's color arguments."""
+    to_tuple = lambda c: tuple(float(x) for x in c)
+    return (
+        tuple(to_tuple(color) for color in colors),
+        None if penlow is None else to_tuple(penlow),
+        None if penhigh is None else to_tuple(penhigh)
+    )
+
+def cmap_lut(cmap="Greys"):
+    """Returns the colormap "cmap" (a name or a matplotlib Colormap) as an
+    (N, 3) uint8 lookup table in BGR order, ready for OpenCV. Tables are
+    built once per colormap."""
+    key = cmap if isinstance(cmap, str) else id(cmap)
+    if key not in LUTS or LUTS[key][0] is not cmap:
+        cmap_obj = plt.get_cmap(cmap) if isinstance(cmap, str) else cmap
+        lut = cmap_obj(np.arange(cmap_obj.N), bytes=True)[:, 2::-1]
+        LUTS[key] = (cmap, np.ascontiguousarray(lut))
+    return LUTS[key][1]
+
+@timed("colormap")
+def shade_to_image(arr, cmap="Greys", size=None, out=None):
+    """Colormaps the 2D array of shades "arr" (in [0, 1]) through cmap_lut
+    and upscales it by nearest neighbour. Returns a BGR uint8 array of shape
+    (height, width, 3).
+
+    Args:
+        arr: 2D array of shades, row 0 at the top of the image; integer
+            arrays hold shades quantized as in "quantize"
+        cmap: colormap name or matplotlib Colormap
+        size: (width, height) of the output in pixels; defaults to arr.shape
+        out: optional (height, width, 3) uint8 array to write into
+    """
+    lut = cmap_lut(cmap)
+    n = len(lut)
+    if arr.dtype.kind in "ui":
+        # fold the dequantization into the lookup table itself
+        scale = shade_scale(arr.dtype)
+        levels = np.arange(scale + 1) / scale
+        lut = lut[np.clip((levels * n).astype(np.intp), 0, n-1)]
+        idx = arr
+    else:
+        idx = np.clip((arr * n).astype(np.intp), 0, n-1)
+
+    if size is not None and tuple(size) != arr.shape[::-1]:
+        width, height = size
+        rows = np.arange(height) * arr.shape[0] // height
+        cols = np.arange(width) * arr.shape[1] // width
+        idx = idx[rows[:, None], cols[None, :]]
+
+    return np.take(lut, idx, axis=0, out=out)
+
+def shade_scale(dtype):
+    """Value standing for shade 1 in an array of the given dtype: the largest
+    integer it can hold for integer dtypes, and 1 for floating point."""
+    dtype = np.dtype(dtype)
+    return int(np.iinfo(dtype).max) if dtype.kind in "ui" else 1
+
+def quantize(shades, dtype):
+    """Converts shades in [0, 1] to values of the given dtype. Integer dtypes
+    store round(shade * shade_scale(dtype)), clipped to their range; other
+    dtypes are returned as is."""
+    dtype = np.dtype(dtype)
+    if dtype.kind not in "ui":
+        return shades
+    scale = shade_scale(dtype)
+    shades = np.rint(np.asarray(shades, dtype=float) * scale)
+    return np.clip(shades, 0, scale).astype(dtype)
 
 def draw_edge(arr, v1, v2, dim, shade=1):
     """Detects and replaces entries in array "arr" that are pierced by the
-    segment (v1, v2) with the quantity "shade". "dim" is used to determine how
-    finely to search for pieced entries."""
-    v1, v2 = np.array(v1), np.array(v2)
-
-    for i in np.linspace(0, 1, num=max(dim)):
-        u = v1 + i*(v2-v1)
-        if u[0]<0 or u[1]<0 or u[0]>dim[0]-1 or u[1]>dim[1]-1:
-            continue
-        if all([d > 200 for d in dim]):
-            arr[round(u[0]), int(math.ceil(u[1]))] = shade
-            arr[round(u[0]), int(math.floor(u[1]))] = shade
-        else:
-            arr[round(u[0]), round(u[1])] = shade
+    segment (v1, v2) with the quantity "shade". The segment is sampled once
+    per pixel of its length; "dim" gives the dimensions of arr."""
+    return draw_edges(arr, [v1], [v2], dim, shades=shade)
+
+@timed("draw_edges")
+def draw_edges(
+    arr,
+    starts,
+    ends,
+    dim,
+    shades=1,
+    depths=None,
+    zbuf=None,
+    bias=1.0,
+    clip=None,
+    origin=(0, 0),
+    max_samples=2**20
+):
+    """Batched form of draw_edge: rasterizes every segment (starts[i], ends[i])
+    into "arr" at once. Each segment is sampled at evenly spaced points, one
+    more than its Chebyshev length in pixels, so consecutive samples are at
+    most one pixel apart along either axis and the drawn line has no gaps.
+    Off-grid samples are dropped and the surviving pixels are written with a
+    single fancy-index assignment, so later segments overwrite earlier ones
+    exactly as repeated draw_edge calls would.
+
+    Segments are first clipped to the grid (or to the bounding box of
+    "clip") with clip_segments, and only the samples inside the clipped
+    parameter range are generated, so work is proportional to the visible
+    part of each segment and segments entirely outside cost nothing.
+
+    With "zbuf", as filled by draw_faces, each sample gets a depth
+    interpolated between its segment's endpoint "depths" and is only written
+    where it is no more than "bias" behind zbuf, so that faces hide the edges
+    behind them but not their own; zbuf itself is not updated.
+
+    Args:
+        arr: 2D array to draw into (modified in place and returned); shades
+            are quantized with "quantize" if it has an integer dtype
+        starts: (E, 2) array of segment start points
+        ends: (E, 2) array of segment end points
+        dim: dimensions of the grid
+        shades: scalar or (E,) array of shades, one per segment
+        depths: (E, 2) array of endpoint depths; zeros if not given
+        zbuf: optional float array shaped like arr holding the depth of the
+            nearest face at each pixel
+        bias: depth tolerance of the test against zbuf
+        clip: optional list of (row0, row1, col0, col1) rectangles (end
+            exclusive); pixels outside all of them are left untouched
+        origin: grid pixel held by arr[0, 0] when arr is a window of the
+            grid, which "clip" must then keep writes inside of
+        max_samples: upper bound on samples held in memory at once
+    """
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    shades = quantize(
+        np.broadcast_to(np.asarray(shades), (len(starts),)), arr.dtype
+    )
+    depths = (
+        np.zeros((len(starts), 2))
+        if depths is None
+        else np.asarray(depths, dtype=float).reshape(-1, 2)
+    )
+    chunks = _edge_chunks(starts, ends, dim, clip, max_samples)
+    for rows, cols, edge, frac in chunks:
+        rows, cols = rows - origin[0], cols - origin[1]
+        if zbuf is not None:
+            d0, d1 = depths[edge, 0], depths[edge, 1]
+            near = d0 + frac*(d1 - d0) <= (
+                zbuf[rows, cols] + bias + _depth_slope(zbuf, rows, cols)
+            )
+            rows, cols, edge = rows[near], cols[near], edge[near]
+        arr[rows, cols] = shades[edge]
 
     return arr
 
+def _depth_slope(zbuf, rows, cols):
+    """Largest change in depth from each pixel (rows, cols) of zbuf to its
+    neighbours along each axis, summed over the two axes. Edge samples are
+    rounded up to a pixel away from the surface they lie on, which can
+    put them that far behind its depth there."""
+    depth = zbuf[rows, cols]
+    slope = np.zeros(len(rows))
+    for axis, size in enumerate(zbuf.shape):
+        along = 0
+        for step in (-1, 1):
+            idx = [rows, cols]
+            idx[axis] = np.clip(idx[axis] + step, 0, size - 1)
+            with np.errstate(invalid="ignore"):
+                diff = np.abs(zbuf[tuple(idx)] - depth)
+            along = np.maximum(along, np.where(np.isfinite(diff), diff, 0))
+        slope += along
+    return slope
+
+def edge_pixels(starts, ends, dim, shades=1, clip=None, max_samples=2**20):
+    """Returns the (rows, cols, shades) arrays of the pixel writes draw_edges
+    would make for the same arguments, in the same order, without a target
+    array. A pixel may appear more than once; the last write wins."""
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    shades = np.broadcast_to(np.asarray(shades), (len(starts),))
+    chunks = list(_edge_chunks(starts, ends, dim, clip, max_samples))
+    if not chunks:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, shades[empty]
+    rows, cols, edge, _ = (np.concatenate(arrs) for arrs in zip(*chunks))
+    return rows, cols, shades[edge]
+
+def _edge_chunks(starts, ends, dim, clip, max_samples):
+    """Yields the pixel writes of draw_edges as (rows, cols, segment index,
+    fraction of the way along the segment) arrays, at most about max_samples
+    at a time. Segments with a non-finite endpoint are skipped."""
+    finite = np.isfinite(starts).all(axis=1) & np.isfinite(ends).all(axis=1)
+    if not finite.all():
+        starts = np.where(finite[:, None], starts, 0)
+        ends = np.where(finite[:, None], ends, 0)
+    delta = np.abs(ends - starts)
+    num = np.ceil(np.maximum(delta[:, 0], delta[:, 1])) + 1
+    thick = all([d > 200 for d in dim])
+
+    # a sample at x lands in row rint(x) and, when thick, in columns
+    # floor(y) and ceil(y), so pad the window by one pixel on the low side
+    window = [0, dim[0]-1, 0, dim[1]-1]
+    if clip is not None:
+        if not len(clip):
+            return
+        rects = np.asarray(clip).reshape(-1, 4)
+        window = [
+            max(window[0], rects[:, 0].min() - 1),
+            min(window[1], rects[:, 1].max()),
+            max(window[2], rects[:, 2].min() - 1),
+            min(window[3], rects[:, 3].max())
+        ]
+    t0, t1 = clip_segments(starts, ends, window)
+    t0, t1 = np.where(finite, t0, 1), np.where(finite, t1, 0)
+
+    # sample indices covering [t0, t1] with a margin of one on either side;
+    # the exact per-sample bounds check below drops any extras
+    first = np.clip(np.floor(t0 * (num-1)) - 1, 0, num-1)
+    last = np.clip(np.ceil(t1 * (num-1)) + 1, 0, num-1)
+    spacing = 1 / np.maximum(num-1, 1)
+    counts = np.where(t0 <= t1, last - first + 1, 0).astype(np.intp)
+    first = first.astype(np.intp)
+    cum = np.cumsum(counts)
+    total = int(cum[-1]) if len(cum) else 0
+
+    for g0 in range(0, total, max_samples):
+        sample = np.arange(g0, min(g0 + max_samples, total))
+        edge = np.searchsorted(cum, sample, side="right")
+        k = first[edge] + sample - (cum[edge] - counts[edge])
+        v1, v2 = starts[edge], ends[edge]
+        frac = k * spacing[edge]
+        u = v1 + frac[:, None]*(v2-v1)
+        keep = (
+            (u[:, 0] >= 0) & (u[:, 1] >= 0)
+            & (u[:, 0] <= dim[0]-1) & (u[:, 1] <= dim[1]-1)
+        )
+        x, y, edge, frac = u[keep, 0], u[keep, 1], edge[keep], frac[keep]
+
+        if thick:
+            rows = np.repeat(np.rint(x).astype(np.intp), 2)
+            cols = np.stack([np.ceil(y), np.floor(y)], axis=1).ravel()
+            cols = cols.astype(np.intp)
+            edge, frac = np.repeat(edge, 2), np.repeat(frac, 2)
+        else:
+            rows = np.rint(x).astype(np.intp)
+            cols = np.rint(y).astype(np.intp)
+
+        if clip is not None:
+            inside = in_rects(rows, cols, clip)
+            rows, cols = rows[inside], cols[inside]
+            edge, frac = edge[inside], frac[inside]
+
+        yield rows, cols, edge, frac
+
+def last_writes(pix, vals):
+    """Resolves a sequence of writes of "vals" to the flat pixel indices
+    "pix", where later writes win. Returns the sorted unique pixels and the
+    value each ends up with."""
+    pix, idx = np.unique(pix[::-1], return_index=True)
+    return pix, vals[::-1][idx]
+
+def scatter_image(image, rows, cols, colors, shape):
+    """Writes "colors" at the pixels (rows, cols) of a 2D array of the given
+    shape into "image", its nearest-neighbour rendering at image's size as
+    made by shade_to_image. Each pixel covers a block of image pixels when
+    upscaling, and may cover none when downscaling."""
+    height, width = image.shape[:2]
+    if (height, width) == tuple(shape):
+        image[rows, cols] = colors
+        return image
+
+    # image rows [top[r], bottom[r]) and columns [left[c], right[c]) show
+    # pixel (r, c)
+    src_rows = np.arange(height) * shape[0] // height
+    src_cols = np.arange(width) * shape[1] // width
+    top = np.searchsorted(src_rows, rows)
+    bottom = np.searchsorted(src_rows, rows, side="right")
+    left = np.searchsorted(src_cols, cols)
+    right = np.searchsorted(src_cols, cols, side="right")
+    span = right - left
+    counts = (bottom - top) * span
+
+    item = np.repeat(np.arange(len(rows)), counts)
+    local = np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    image[
+        top[item] + local // np.maximum(span[item], 1),
+        left[item] + local % np.maximum(span[item], 1)
+    ] = colors[item]
+    return image
+
+def clip_segments(starts, ends, window):
+    """Liang-Barsky clipping of every segment (starts[i], ends[i]) against
+    the rectangle window = (xmin, xmax, ymin, ymax) at once. Returns arrays
+    (t0, t1) such that the part of segment i inside the window is
+    starts[i] + t*(ends[i]-starts[i]) for t in [t0[i], t1[i]]; segments
+    entirely outside have t0 > t1."""
+    xmin, xmax, ymin, ymax = window
+    delta = ends - starts
+    t0, t1 = np.zeros(len(starts)), np.ones(len(starts))
+    outside = np.zeros(len(starts), dtype=bool)
+    bounds = [
+        (-delta[:, 0], starts[:, 0] - xmin),
+        (delta[:, 0], xmax - starts[:, 0]),
+        (-delta[:, 1], starts[:, 1] - ymin),
+        (delta[:, 1], ymax - starts[:, 1])
+    ]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in bounds:
+            ratio = q / p
+            t0 = np.where(p < 0, np.maximum(t0, ratio), t0)
+            t1 = np.where(p > 0, np.minimum(t1, ratio), t1)
+            outside |= (p == 0) & (q < 0)
+
+    t0[outside], t1[outside] = 1, 0
+    return t0, t1
+
+def in_rects(rows, cols, rects):
+    """Boolean mask of the pixels (rows[i], cols[i]) that fall inside any of
+    the (row0, row1, col0, col1) rectangles (end exclusive) in "rects"."""
+    inside = np.zeros(len(rows), dtype=bool)
+    for r0, r1, c0, c1 in rects:
+        inside |= (rows >= r0) & (rows < r1) & (cols >= c0) & (cols < c1)
+    return inside
+
+def front_facing(pts, faces):
+    """Whether each polygon in the (F, k) array "faces" faces the camera,
+    given the (N, 2) projected vertices "pts". Faces are wound
+    counterclockwise seen from outside and the camera looks along +z, so a
+    face is front-facing when the z-component of its projected normal, the
+    2D cross product of two of its sides, is negative."""
+    a, b, c = pts[faces[:, 0]], pts[faces[:, 1]], pts[faces[:, 2]]
+    u, v = b - a, c - a
+    return u[:, 0]*v[:, 1] - u[:, 1]*v[:, 0] < 0
+
+def visible_edges(n_edges, edge_faces, facing):
+    """Back-face culling for wireframes: returns a boolean mask over the
+    edges that keeps an edge if any face bordering it is front-facing, or if
+    no face borders it. "edge_faces" holds (edge index, face index) pairs and
+    "facing" is front_facing for the faces."""
+    edge_idx, face_idx = edge_faces[:, 0], edge_faces[:, 1]
+    bordered = np.bincount(edge_idx, minlength=n_edges) > 0
+    front = np.bincount(
+        edge_idx, weights=facing[face_idx], minlength=n_edges
+    ) > 0
+    return front | ~bordered
+
+def edge_bbox(starts, ends, dim):
+    """Returns the (row0, row1, col0, col1) rectangle (end exclusive) of grid
+    pixels that draw_edges can write for the given segments, clipped to the
+    grid. Empty rectangles have row0 >= row1 or col0 >= col1."""
+    if len(starts) == 0:
+        return (0, 0, 0, 0)
+    pts = np.concatenate([starts, ends])
+    lo = np.floor(pts.min(axis=0)).astype(int)
+    hi = np.ceil(pts.max(axis=0)).astype(int) + 1
+    return (
+        max(lo[0], 0), min(hi[0], dim[0]), max(lo[1], 0), min(hi[1], dim[1])
+    )
+
+def segment_bboxes(starts, ends, dim):
+    """(E, 4) int array holding the edge_bbox of each segment separately.
+    Also gives the pixels a triangle can cover when passed the per-axis
+    minimum and maximum of its vertices."""
+    lo = np.floor(np.minimum(starts, ends)).astype(np.intp)
+    hi = np.ceil(np.maximum(starts, ends)).astype(np.intp) + 1
+    return np.stack([
+        np.maximum(lo[:, 0], 0),
+        np.minimum(hi[:, 0], dim[0]),
+        np.maximum(lo[:, 1], 0),
+        np.minimum(hi[:, 1], dim[1])
+    ], axis=1)
+
+def tile_bins(boxes, tile):
+    """Bins items by the tiles of size tile = (rows, cols) that their
+    (row0, row1, col0, col1) boxes overlap. Returns a dict mapping tile
+    indices (i, j) to the int array of items overlapping tile (i, j), in
+    their original order."""
+    boxes = np.asarray(boxes, dtype=np.intp).reshape(-1, 4)
+    valid = (boxes[:, 0] < boxes[:, 1]) & (boxes[:, 2] < boxes[:, 3])
+    lo = boxes[:, [0, 2]] // tile
+    hi = (boxes[:, [1, 3]] - 1) // tile
+    span = np.where(valid[:, None], hi - lo + 1, 0)
+    counts = span[:, 0] * span[:, 1]
+
+    item = np.repeat(np.arange(len(boxes)), counts)
+    local = np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    ti = lo[item, 0] + local // span[item, 1]
+    tj = lo[item, 1] + local % span[item, 1]
+
+    if not len(item):
+        return {}
+    order = np.lexsort((item, tj, ti))
+    ti, tj, item = ti[order], tj[order], item[order]
+    starts = np.flatnonzero(
+        np.r_[True, (ti[1:] != ti[:-1]) | (tj[1:] != tj[:-1])]
+    )
+    return {
+        (int(ti[a]), int(tj[a])):items
+        for a, items in zip(starts, np.split(item, starts[1:]))
+    }
+
+def rects_overlap(rect, rects):
+    """Whether the rectangle "rect" intersects any rectangle in "rects"."""
+    r0, r1, c0, c1 = rect
+    return any(
+        max(r0, s0) < min(r1, s1) and max(c0, t0) < min(c1, t1)
+        for s0, s1, t0, t1 in rects
+    )
+
 def draw_face(arr, face, dim, shade):
     """Draws face on 2D array given the corresponding vertices and shade. For
     3D drawings, only projected vertices must be passed."""
-    pass
+    face = np.asarray(face, dtype=float)
+    tris = face[fan_triangles([np.arange(len(face))])]
+    return draw_faces(arr, tris, dim, shades=shade)
+
+@timed("draw_faces")
+def draw_faces(
+    arr,
+    tris,
+    dim,
+    shades=1,
+    depths=None,
+    zbuf=None,
+    clip=None,
+    origin=(0, 0),
+    max_samples=2**20
+):
+    """Fills a batch of triangles into "arr". A pixel is covered by a triangle
+    when its center, at integer grid coordinates as in draw_edges, lies
+    inside or on the triangle. Candidate pixels are enumerated over every
+    triangle's bounding box, narrowed to the bounding box of "clip", and
+    tested with barycentric coordinates in bulk.
+
+    Without "zbuf" later triangles overwrite earlier ones. With it, each
+    covered pixel gets a depth interpolated from "depths" and is written
+    only if that depth does not exceed zbuf (smaller is nearer), which is
+    updated in place; ties go to the later triangle.
+
+    Args:
+        arr: 2D array to draw into (modified in place and returned); shades
+            are quantized with "quantize" if it has an integer dtype
+        tris: (T, 3, 2) array of triangle vertices in grid coordinates
+        dim: dimensions of the grid
+        shades: scalar or (T,) array of shades, one per triangle
+        depths: (T, 3) array of vertex depths; zeros if not given
+        zbuf: optional float array shaped like arr holding the nearest depth
+            drawn so far at each pixel
+        clip: optional list of (row0, row1, col0, col1) rectangles (end
+            exclusive); pixels outside all of them are left untouched
+        origin: grid pixel held by arr[0, 0] when arr is a window of the
+            grid, which "clip" must then keep writes inside of
+        max_samples: upper bound on candidate pixels held in memory at once
+    """
+    tris = np.asarray(tris, dtype=float).reshape(-1, 3, 2)
+    shades = quantize(
+        np.broadcast_to(np.asarray(shades), (len(tris),)), arr.dtype
+    )
+    depths = (
+        np.zeros((len(tris), 3))
+        if depths is None
+        else np.asarray(depths, dtype=float).reshape(-1, 3)
+    )
+    window = np.array([0, 0]), np.asarray(dim) - 1
+    if clip is not None:
+        if not len(clip):
+            return arr
+        rects = np.asarray(clip).reshape(-1, 4)
+        window = (
+            np.maximum(window[0], rects[:, [0, 2]].min(axis=0)),
+            np.minimum(window[1], rects[:, [1, 3]].max(axis=0) - 1)
+        )
+    lo = np.maximum(np.ceil(tris.min(axis=1)), window[0]).astype(np.intp)
+    hi = np.minimum(np.floor(tris.max(axis=1)), window[1])
+    extent = np.maximum(hi.astype(np.intp) - lo + 1, 0)
+    area = extent[:, 0] * extent[:, 1]
+    cum = np.cumsum(area)
+    total = int(cum[-1]) if len(cum) else 0
+
+    for g0 in range(0, total, max_samples):
+        cand = np.arange(g0, min(g0 + max_samples, total))
+        tri = np.searchsorted(cum, cand, side="right")
+        local = cand - (cum[tri] - area[tri])
+        rows = lo[tri, 0] + local // extent[tri, 1]
+        cols = lo[tri, 1] + local % extent[tri, 1]
+
+        a, b, c = tris[tri, 0], tris[tri, 1], tris[tri, 2]
+        p = np.stack([rows, cols], axis=1)
+        cross = lambda u, v: u[:, 0]*v[:, 1] - u[:, 1]*v[:, 0]
+        denom = cross(b - a, c - a)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lb = cross(p - a, c - a) / denom
+            lc = cross(b - a, p - a) / denom
+        la = 1 - lb - lc
+        eps = -1e-9
+        keep = (denom != 0) & (la >= eps) & (lb >= eps) & (lc >= eps)
+
+        if clip is not None:
+            keep &= in_rects(rows, cols, clip)
+
+        rows, cols, tri = rows[keep], cols[keep], tri[keep]
+        vals = shades[tri]
+
+        if zbuf is not None:
+            depth = (
+                la[keep]*depths[tri, 0]
+                + lb[keep]*depths[tri, 1]
+                + lc[keep]*depths[tri, 2]
+            )
+            # nearest candidate per pixel, the later triangle winning ties
+            pix = rows * dim[1] + cols
+            order = np.lexsort((-tri, depth, pix))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = pix[order][1:] != pix[order][:-1]
+            order = order[first]
+            rows, cols = rows - origin[0], cols - origin[1]
+            order = order[depth[order] <= zbuf[rows[order], cols[order]]]
+            rows, cols, vals = rows[order], cols[order], vals[order]
+            zbuf[rows, cols] = depth[order]
+        else:
+            rows, cols = rows - origin[0], cols - origin[1]
+
+        arr[rows, cols] = vals
+
+    return arr
 
 def projection(shp, node, griddim, proj="persp"):
-    """Orthographic projection followed by a scaling of the point "node" onto
-    the x-y plane. Camera position (xc, yc) is taken to be the center of mass
-    of the shape. Used in draw_shapes method."""
-    x, y, z = np.array(shp.nodes[node]["pos"])
-
-    if proj == "persp":
-        xc, yc, zc = center_of_mass(shp, dims = shp.dims)
-        xp = (max(griddim)/(max(griddim)+2*abs(zc))) * (x-xc) + xc
-        yp = (max(griddim)/(max(griddim)+2*abs(zc))) * (y-yc) + yc
-        return (xp, yp)
-    elif proj == "ortho":
-        return (x, y)
-
-def gradient(x, dim):
-    idx, val = x
-    temp_val = 1-idx[0]/(dim[0]-1)-idx[1]/(dim[1]-1)
-    return [idx, (temp_val+1)/2]
-
-def radial(x, dim):
-    idx, val = x
-    return [idx, 1 - abs(0.50-idx[0]/(dim[0]-1)) - abs(0.50-idx[1]/(dim[1]-1))]
-
-def white(x, dim):
-    idx, val = x
-    return [idx, 0]
-
-def black(x, dim):
-    idx, val = x
-    return [idx, 1]
-
-def uniform_shade(x, shade):
-    idx, val = x
-    return [idx, shade]
+    """Projects the vertex "node" of a 3D shape onto the x-y plane with the
+    Camera preset named by "proj" (or a Camera instance). Prefer
+    Camera.project_shape, which projects every vertex in one call."""
+    xy, depth = Camera.from_proj(proj).project_shape(shp, griddim)
+    return tuple(xy[node])
+
+def paint_presets():
+    """Returns a dict mapping preset paint names to their array functions,
+    which take the grid dimensions and an optional window of the grid."""
+    return {
+        "gradient":gradient,
+        "radial":radial,
+        "white":white,
+        "black":black
+    }
+
+def painted_canvas(paint, dim, dtype="float64"):
+    """Returns a read-only canvas of shape "dim" painted with "paint", which is
+    either a preset name or a uniform shade. Values are clamped to
+    [0.005, 0.995] so that they never collide with the pen bands of
+    rgb_to_cmap. Integer dtypes are quantized with "quantize". Results are
+    memoized on (paint, dim, dtype) in CANVASES, so callers should copy
+    before writing. The cache is capped at CANVAS_CACHE_BYTES, but always
+    keeps the canvas last used."""
+    key = (paint, dim, dtype)
+    if key in CANVASES:
+        CANVASES.move_to_end(key)
+        return CANVASES[key]
+    canvas = paint_window(paint, dim, (0, dim[0], 0, dim[1]), dtype)
+    canvas.flags.writeable = False
+    CANVASES[key] = canvas
+    total = sum(arr.nbytes for arr in CANVASES.values())
+    while total > CANVAS_CACHE_BYTES and len(CANVASES) > 1:
+        total -= CANVASES.popitem(last=False)[1].nbytes
+    return canvas
+
+def paint_window(paint, dim, window, dtype="float64"):
+    """Returns the (row0, row1, col0, col1) window (end exclusive) of the
+    canvas painted_canvas(paint, dim, dtype) as a new array, without
+    evaluating the rest of the canvas."""
+    if isinstance(paint, str):
+        vals = paint_presets()[paint](dim, window)
+    else:
+        vals = uniform_shade(dim, paint, window)
+    shape = (window[1] - window[0], window[3] - window[2])
+    canvas = np.clip(np.broadcast_to(vals, shape), 0.005, 0.995)
+    return quantize(canvas, dtype).astype(dtype)
+
+def _unit_axes(dim, window=None):
+    """Row and column indices of a grid of shape "dim" scaled to [0, 1] and
+    shaped for broadcasting against each other, restricted to the
+    (row0, row1, col0, col1) window if given."""
+    r0, r1, c0, c1 = window or (0, dim[0], 0, dim[1])
+    x = np.arange(r0, r1)[:, None] / (dim[0]-1)
+    y = np.arange(c0, c1)[None, :] / (dim[1]-1)
+    return x, y
+
+def _window_shape(dim, window=None):
+    r0, r1, c0, c1 = window or (0, dim[0], 0, dim[1])
+    return (r1 - r0, c1 - c0)
+
+def gradient(dim, window=None):
+    x, y = _unit_axes(dim, window)
+    temp_val = 1-x-y
+    return (temp_val+1)/2
+
+def radial(dim, window=None):
+    x, y = _unit_axes(dim, window)
+    return 1 - abs(0.50-x) - abs(0.50-y)
+
+def white(dim, window=None):
+    return np.zeros(_window_shape(dim, window))
+
+def black(dim, window=None):
+    return np.ones(_window_shape(dim, window))
+
+def uniform_shade(dim, shade, window=None):
+    return np.full(_window_shape(dim, window), shade, dtype=float)
@@ -3,8 +3,39 @@ import math
 import networkx as nx
 import numpy as np
 
+from InstancedShape import InstancedShape
+from Profiler import timed
 from Shape import Shape
-from shape_utils import center_of_mass
+from shape_utils import rotation_matrices
+
+
+# Unit geometry shared by every Shape a constructor returns, built on first
+# use from the corresponding *_nx graph and keyed by (kind, options)
+TEMPLATES = {}
+
+# Triangular faces of the icosahedron built by icosahedron_nx
+ICOSAHEDRON_FACES = [
+    [0, 1, 2],
+    [0, 1, 7],
+    [0, 2, 9],
+    [0, 6, 7],
+    [0, 6, 9],
+    [1, 2, 3],
+    [1, 3, 8],
+    [1, 7, 8],
+    [2, 3, 5],
+    [2, 5, 9],
+    [3, 4, 5],
+    [3, 4, 8],
+    [4, 5, 11],
+    [4, 8, 10],
+    [4, 10, 11],
+    [5, 9, 11],
+    [6, 7, 10],
+    [6, 9, 11],
+    [6, 10, 11],
+    [7, 8, 10]
+]
 
 
 def tetrahedron_nx(center, rad):
@@ -29,20 +60,7 @@ def tetrahedron_nx(center, rad):
 
 def tetrahedron(name, center, rad, shade=1, rand=False):
     """Create tetrahedron Shape object."""
-    cfg = {
-        "name":name,
-        "shade":shade,
-        "dims":3,
-        "graph":tetrahedron_nx(center, rad)
-    }
-    shp = Shape.from_nx(**cfg)
-    com = center_of_mass(shp, dims=3)
-    factor = rad / np.linalg.norm(shp.nodes[0]["pos"] - com)
-    shp.scale(factor)
-
-    if rand:
-        shp.rotate_3d(axis=np.random.rand(3), angle=2*math.pi*np.random.rand())
-    return shp
+    return instantiate("tetrahedron", name, center, rad, shade=shade, rand=rand)
 
 def cube_nx(center, rad):
     """Create cube nx.Graph."""
@@ -76,20 +94,7 @@ def cube_nx(center, rad):
 
 def cube(name, center, rad, shade=1, rand=False):
     """Create cube Shape object."""
-    cfg = {
-        "name":name,
-        "shade":shade,
-        "dims":3,
-        "graph":cube_nx(center, rad)
-    }
-    shp = Shape.from_nx(**cfg)
-    com = center_of_mass(shp, dims=3)
-    factor = rad / np.linalg.norm(shp.nodes[0]["pos"] - com)
-    shp.scale(factor)
-
-    if rand:
-        shp.rotate_3d(axis=np.random.rand(3), angle=2*math.pi*np.random.rand())
-    return shp
+    return instantiate("cube", name, center, rad, shade=shade, rand=rand)
 
 def octahedron_nx(center, rad, isosceles=False):
     """Create octahedron nx.Graph."""
@@ -121,19 +126,10 @@ def octahedron_nx(center, rad, isosceles=False):
 
 def octahedron(name, center, rad, shade=1, rand=False, isosceles=False):
     """Create octahedron Shape object."""
-    cfg = {
-        "name":name,
-        "shade":shade,
-        "dims":3,
-        "graph":octahedron_nx(center, rad, isosceles)
-    }
-    shp = Shape.from_nx(**cfg)
-    factor = rad / np.linalg.norm(shp.nodes[0]["pos"] - shp.get_com())
-    shp.scale(factor)
-
-    if rand:
-        shp.rotate_3d(axis=np.random.rand(3), angle=2*math.pi*np.random.rand())
-    return shp
+    return instantiate(
+        "octahedron", name, center, rad, shade=shade, rand=rand,
+        isosceles=isosceles
+    )
 
 def dodecahedron_nx(center, rad):
     """Create dodecahedron nx.Graph."""
@@ -154,28 +150,7 @@ def dodecahedron_nx(center, rad):
         11:np.array([-c, -1, 0]) / n
     }
     graph = nx.Graph()
-    faces = [
-        [0, 1, 2],
-        [0, 1, 7],
-        [0, 2, 9],
-        [0, 6, 7],
-        [0, 6, 9],
-        [1, 2, 3],
-        [1, 3, 8],
-        [1, 7, 8],
-        [2, 3, 5],
-        [2, 5, 9],
-        [3, 4, 5],
-        [3, 4, 8],
-        [4, 5, 11],
-        [4, 8, 10],
-        [4, 10, 11],
-        [5, 9, 11],
-        [6, 7, 10],
-        [6, 9, 11],
-        [6, 10, 11],
-        [7, 8, 10]
-    ]
+    faces = ICOSAHEDRON_FACES
     n_faces = len(faces)
 
     centers_of_mass = [
@@ -197,23 +172,7 @@ def dodecahedron_nx(center, rad):
 
 def dodecahedron(name, center, rad, shade=1, rand=False):
     """Create dodecahedron Shape object."""
-    cfg = {
-        "name":name,
-        "shade":shade,
-        "dims":3,
-        "graph":dodecahedron_nx(center, rad)
-    }
-    shp = Shape.from_nx(**cfg)
-
-    center = np.asarray(center)
-    shp.translate(direction=center)
-    com = center_of_mass(shp, dims=3)
-    factor = rad / np.linalg.norm(shp.nodes[0]["pos"] - com)
-    shp.scale(factor)
-
-    if rand:
-        shp.rotate_3d(axis=np.random.rand(3), angle=2*math.pi*np.random.rand())
-    return shp
+    return instantiate("dodecahedron", name, center, rad, shade=shade, rand=rand)
 
 def icosahedron_nx(center, rad):
     """Create icosahedron nx.Graph."""
@@ -262,20 +221,7 @@ def icosahedron_nx(center, rad):
 
 def icosahedron(name, center, rad, shade=1, rand=False):
     """Create icosahedron Shape object."""
-    cfg = {
-        "name":name,
-        "shade":shade,
-        "dims":3,
-        "graph":icosahedron_nx(center, rad)
-    }
-    shp = Shape.from_nx(**cfg)
-    com = center_of_mass(shp, dims=3)
-    factor = rad / np.linalg.norm(shp.nodes[0]["pos"] - com)
-    shp.scale(factor)
-
-    if rand:
-        shp.rotate_3d(axis=np.random.rand(3), angle=2*math.pi*np.random.rand())
-    return shp
+    return instantiate("icosahedron", name, center, rad, shade=shade, rand=rand)
 
 def triambic_icosahedron_nx(center, rad, keep_edges=False):
     """Create icosahedron nx.Graph. If keep_edges, then edges of regular
@@ -312,28 +258,7 @@ def triambic_icosahedron_nx(center, rad, keep_edges=False):
         (10, {"pos": vertices[10]}),
         (11, {"pos": vertices[11]})
     ])
-    faces = [
-        [0, 1, 2],
-        [0, 1, 7],
-        [0, 2, 9],
-        [0, 6, 7],
-        [0, 6, 9],
-        [1, 2, 3],
-        [1, 3, 8],
-        [1, 7, 8],
-        [2, 3, 5],
-        [2, 5, 9],
-        [3, 4, 5],
-        [3, 4, 8],
-        [4, 5, 11],
-        [4, 8, 10],
-        [4, 10, 11],
-        [5, 9, 11],
-        [6, 7, 10],
-        [6, 9, 11],
-        [6, 10, 11],
-        [7, 8, 10]
-    ]
+    faces = ICOSAHEDRON_FACES
 
     for idx, face in enumerate(faces):
         com = np.asarray([
@@ -366,19 +291,135 @@ def triambic_icosahedron(
 ):
     """Create icosahedron Shape object. If keep_edges, then edges of regular
     icosahedron are retained."""
-    cfg = {
-        "name":name,
-        "shade":shade,
-        "dims":3,
-        "graph":triambic_icosahedron_nx(center, rad, keep_edges)
-    }
-    shp = Shape.from_nx(**cfg)
-    center = np.asarray(center)
-    shp.translate(direction=center)
-    com = center_of_mass(shp, dims=3)
-    factor = rad / 3
-    shp.scale(factor)
+    return instantiate(
+        "triambic_icosahedron", name, center, rad, shade=shade, rand=rand,
+        keep_edges=keep_edges
+    )
+
+def solid_faces(kind):
+    """Returns the faces of a shape_lib solid as lists of vertex indices in
+    cyclic order around each face."""
+    if kind == "tetrahedron":
+        return [[0, 1, 2], [0, 1, 3], [0, 2, 3], [1, 2, 3]]
+    elif kind == "cube":
+        return [
+            [0, 1, 3, 2], [4, 5, 7, 6], [0, 1, 5, 4],
+            [2, 3, 7, 6], [0, 2, 6, 4], [1, 3, 7, 5]
+        ]
+    elif kind == "octahedron":
+        return [
+            [0, 1, 4], [1, 3, 4], [3, 2, 4], [2, 0, 4],
+            [0, 1, 5], [1, 3, 5], [3, 2, 5], [2, 0, 5]
+        ]
+    elif kind == "icosahedron":
+        return ICOSAHEDRON_FACES
+    elif kind == "dodecahedron":
+        # vertex i of the dodecahedron sits over icosahedron face i, so the
+        # five icosahedron faces around each icosahedron vertex form a
+        # pentagon, ordered by walking across shared icosahedron edges
+        faces = []
+        for vertex in range(12):
+            ring = [
+                i for i, face in enumerate(ICOSAHEDRON_FACES) if vertex in face
+            ]
+            cycle = [ring.pop(0)]
+            while ring:
+                last = set(ICOSAHEDRON_FACES[cycle[-1]])
+                step = next(
+                    i for i in ring
+                    if len(set(ICOSAHEDRON_FACES[i]) & last) == 2
+                )
+                ring.remove(step)
+                cycle.append(step)
+            faces.append(cycle)
+        return faces
+    elif kind == "triambic_icosahedron":
+        return [
+            [idx + 12, u, v]
+            for idx, (a, b, c) in enumerate(ICOSAHEDRON_FACES)
+            for u, v in [(a, b), (b, c), (c, a)]
+        ]
+
+def template(kind, **opts):
+    """Returns the unit (pos, edges, faces) arrays of a shape_lib solid,
+    building them on first use. Vertices are centered on the origin and
+    scaled so that a shape of radius "rad" is obtained as center + rad * pos.
+    Faces are wound counterclockwise seen from outside the solid. The arrays
+    are read-only and shared between all shapes of the same kind."""
+    key = (kind,) + tuple(sorted(opts.items()))
+    if key not in TEMPLATES:
+        builders = {
+            "tetrahedron":tetrahedron_nx,
+            "cube":cube_nx,
+            "octahedron":octahedron_nx,
+            "dodecahedron":dodecahedron_nx,
+            "icosahedron":icosahedron_nx,
+            "triambic_icosahedron":triambic_icosahedron_nx
+        }
+        shp = Shape.from_nx(
+            builders[kind](center=np.zeros(3), rad=1, **opts),
+            name=kind,
+            dims=3
+        )
+        pos = shp.pos - shp.get_com()
+        # triambic icosahedra are scaled by rad/3 rather than to put vertex 0
+        # at distance rad
+        norm = 3 if kind == "triambic_icosahedron" else np.linalg.norm(pos[0])
+        pos, edges = pos / norm, shp.edges
+        faces = np.array(solid_faces(kind), dtype=np.intp)
+        corners = pos[faces]
+        normals = np.cross(
+            corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]
+        )
+        inward = np.einsum("ij,ij->i", normals, corners.mean(axis=1)) < 0
+        faces[inward] = faces[inward, ::-1]
+        for arr in (pos, edges, faces):
+            arr.flags.writeable = False
+        TEMPLATES[key] = (pos, edges, faces)
+    return TEMPLATES[key]
+
+@timed("shape_lib")
+def instantiate(kind, name, center, rad, shade=1, rand=False, **opts):
+    """Create a Shape of the given kind by scaling and translating its cached
+    template, optionally followed by a random rotation about its center."""
+    pos, edges, faces = template(kind, **opts)
+    shp = Shape(
+        name=name,
+        shade=shade,
+        dims=3,
+        pos=np.asarray(center) + rad * pos,
+        edges=edges,
+        faces=faces
+    )
 
     if rand:
         shp.rotate_3d(axis=np.random.rand(3), angle=2*math.pi*np.random.rand())
     return shp
+
+@timed("shape_lib")
+def instances(kind, name, centers, rads, shades=1, rand=False, **opts):
+    """Create an InstancedShape holding K solids of the given kind, the k-th
+    of radius rads[k] centered on centers[k], sharing one cached template.
+    "rads" and "shades" may be scalars. If "rand", each copy is given its
+    own random rotation about its center, as instantiate does."""
+    pos, edges, faces = template(kind, **opts)
+    centers = np.asarray(centers, dtype=float).reshape(-1, 3)
+    rads = np.broadcast_to(np.asarray(rads, dtype=float), (len(centers),))
+
+    transforms = np.tile(np.eye(4), (len(centers), 1, 1))
+    linear = rads[:, None, None] * np.eye(3)
+    if rand:
+        axes = np.random.rand(len(centers), 3)
+        angles = 2*math.pi*np.random.rand(len(centers))
+        linear = rotation_matrices(axes, angles) @ linear
+    transforms[:, :3, :3] = linear
+    transforms[:, :3, 3] = centers
+
+    return InstancedShape(
+        name=name,
+        pos=pos,
+        edges=edges,
+        faces=faces,
+        transforms=transforms,
+        shades=shades
+    )
@@ -3,12 +3,12 @@ import numpy as np
 
 
 def center_of_mass(shp, dims=2):
-    """Get dims-dimensional center of mass of vertices in an nx.Graph"""
-    com = np.asarray([
-        np.mean([shp.nodes[pt]["pos"][i] for pt in list(shp.nodes)])
-        for i in range(dims)
-    ])
-    return com
+    """Get dims-dimensional center of mass of vertices in a Shape or in an
+    nx.Graph whose nodes carry a "pos" attribute"""
+    pos = getattr(shp, "pos", None)
+    if pos is None:
+        pos = np.asarray([shp.nodes[pt]["pos"] for pt in list(shp.nodes)])
+    return np.asarray(pos)[:, :dims].mean(axis=0)
 
 def rotate_point_2d(origin, point, angle):
     ox, oy = origin
@@ -17,6 +17,13 @@ def rotate_point_2d(origin, point, angle):
     qy = oy + math.sin(angle)*(px - ox) + math.cos(angle)*(py - oy)
     return np.array([qx, qy])
 
+def rotation_matrix_2d(angle):
+    """Counterclockwise rotation by angle in 2D, as used by rotate_point_2d."""
+    return np.array([
+        [math.cos(angle), -math.sin(angle)],
+        [math.sin(angle), math.cos(angle)]
+    ])
+
 def rotation_matrix(axis, angle):
     """Euler-Rodrigues formula for rotation about axis in 3D."""
     axis = np.asarray(axis)
@@ -31,3 +38,84 @@ def rotation_matrix(axis, angle):
         [2*(bc - ad), aa + cc - bb - dd, 2*(cd + ab)],
         [2*(bd + ac), 2*(cd - ab), aa + dd - bb - cc]
     ])
+
+def rotation_matrices(axes, angles):
+    """(K, 3, 3) stack of the rotation_matrix of each of the K rows of "axes"
+    and entries of "angles", built at once."""
+    axes = np.asarray(axes, dtype=float).reshape(-1, 3)
+    axes = axes / np.sqrt(np.einsum("ij,ij->i", axes, axes))[:, None]
+    angles = np.asarray(angles, dtype=float)
+    a = np.cos(angles/2)
+    b, c, d = (-axes * np.sin(angles/2)[:, None]).T
+    aa, bb, cc, dd = a*a, b*b, c*c, d*d
+    bc, ad, ac, ab, bd, cd = b*c, a*d, a*c, a*b, b*d, c*d
+
+    return np.stack([
+        np.stack([aa + bb - cc - dd, 2*(bc + ad), 2*(bd - ac)], axis=-1),
+        np.stack([2*(bc - ad), aa + cc - bb - dd, 2*(cd + ab)], axis=-1),
+        np.stack([2*(bd + ac), 2*(cd - ab), aa + dd - bb - cc], axis=-1)
+    ], axis=1)
+
+def affine_matrix(linear=None, center=None, offset=None):
+    """4x4 homogeneous matrix that applies the 2x2 or 3x3 matrix "linear"
+    about the point "center" and then translates by "offset". 2D inputs are
+    embedded in the z = 0 plane."""
+    mat = np.eye(4)
+    if linear is not None:
+        linear = np.asarray(linear)
+        mat[:len(linear), :len(linear)] = linear
+    if center is not None:
+        center = _embed_3d(center)
+        mat[:3, 3] = center - mat[:3, :3] @ center
+    if offset is not None:
+        mat[:3, 3] += _embed_3d(offset)
+    return mat
+
+def apply_affine(points, mat):
+    """Apply the 4x4 homogeneous matrix "mat" to an (N, dims) array of points,
+    for dims of 2 or 3."""
+    points = np.asarray(points)
+    dims = points.shape[-1]
+    return points @ mat[:dims, :dims].T + mat[:dims, 3]
+
+def _embed_3d(point):
+    out = np.zeros(3)
+    point = np.asarray(point, dtype=float)
+    out[:len(point)] = point
+    return out
+
+def fan_triangles(faces):
+    """Split an (F, k) array of convex polygons into an (F*(k-2), 3) array of
+    triangles fanning out from each polygon's first vertex."""
+    faces = np.asarray(faces)
+    k = faces.shape[1]
+    return np.stack([
+        np.stack([faces[:, 0], faces[:, i], faces[:, i+1]], axis=1)
+        for i in range(1, k-1)
+    ], axis=1).reshape(-1, 3)
+
+def edge_face_pairs(edges, faces):
+    """Match the sides of the polygons in the (F, k) array "faces" against
+    the (E, 2) array "edges". Returns an (M, 2) int array of (edge index,
+    face index) pairs; face sides that are not edges are skipped."""
+    if faces is None or len(faces) == 0 or len(edges) == 0:
+        return np.zeros((0, 2), dtype=np.intp)
+    n = max(edges.max(), faces.max()) + 1
+    key = lambda u, v: np.minimum(u, v) * n + np.maximum(u, v)
+    edge_keys = key(edges[:, 0], edges[:, 1])
+    order = np.argsort(edge_keys)
+    side_keys = key(faces, np.roll(faces, -1, axis=1)).ravel()
+    sorted_keys = edge_keys[order]
+    loc = np.searchsorted(sorted_keys, side_keys).clip(0, len(edges)-1)
+    found = sorted_keys[loc] == side_keys
+    face_idx = np.repeat(np.arange(len(faces)), faces.shape[1])
+    return np.stack([order[loc[found]], face_idx[found]], axis=1)
+
+def tile_indices(idx, count, stride):
+    """Repeat the int array "idx" "count" times, offsetting the k-th copy by
+    k * stride, and stack the copies along the first axis. "stride" may be
+    a scalar or broadcast against the last axis of idx."""
+    idx = np.asarray(idx, dtype=np.intp)
+    offsets = np.arange(count).reshape((-1,) + (1,)*idx.ndim)
+    tiled = idx[None] + offsets * np.asarray(stride, dtype=np.intp)
+    return tiled.reshape((-1,) + idx.shape[1:])
@@ -0,0 +1,205 @@
+import argparse
+import json
+import math
+import numpy as np
+import os, sys
+import tempfile
+import timeit
+
+# add src to sys path
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src"
+    )
+)
+
+from Animation import Animation
+from Grid import Grid
+from grid_utils import *
+from Shape import Shape
+from shape_lib import *
+
+# Times the rendering hot paths over a matrix of grid sizes and vertex
+# counts. Run with --update to record the results as the baseline, and
+# without it to compare against the baseline: the script exits with status
+# 1 if any benchmark is slower than the baseline by more than --threshold.
+#
+#   python tests/benchmark.py --update
+#   python tests/benchmark.py --threshold 1.5
+
+SIZES = [100, 500, 1000, 2000, 4000]
+VERTICES = [10, 1000, 100000]
+SOLIDS = [
+    "tetrahedron",
+    "cube",
+    "octahedron",
+    "dodecahedron",
+    "icosahedron",
+    "triambic_icosahedron"
+]
+
+def best_time(func, repeat=5, budget=0.2):
+    """Best time in seconds of one call of func, out of "repeat" runs of as
+    many calls as fit in roughly "budget" seconds."""
+    timer = timeit.Timer(func)
+    number, total = timer.autorange()
+    number = max(1, int(number * budget / max(total, 1e-9)))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def random_shape(n, name="random"):
+    """3D Shape with n random vertices joined in a chain."""
+    rng = np.random.default_rng(0)
+    edges = np.stack([np.arange(n-1), np.arange(1, n)], axis=1)
+    return Shape(name=name, dims=3, pos=rng.random((n, 3)), edges=edges)
+
+def solid(kind, size, name="solid"):
+    np.random.seed(0)
+    center, rad = (size/2, size/2, size/10), 0.4*size
+    if kind == "triambic_icosahedron":
+        rad = 1.2*size
+    return instantiate(kind, name, center, rad, rand=True)
+
+def bench_draw_edge(size):
+    arr = np.zeros((size, size))
+    dim = (size, size)
+    return best_time(lambda: draw_edge(arr, (0, 0), (size-1, size/3), dim))
+
+def bench_draw_shapes(size, kind):
+    grid = Grid([solid(kind, size)], (size, size))
+    grid.paint_canvas("gradient")
+
+    def step():
+        grid.rotate_shape_3d("solid", axis=[1, 1, 0], angle=0.05)
+        grid.draw_shapes()
+    return best_time(step)
+
+def bench_paint_canvas(size, paint):
+    grid = Grid([], (size, size))
+
+    def step():
+        CANVASES.clear()
+        grid.paint_canvas(paint)
+    return best_time(step)
+
+def bench_transform(n, method):
+    shp = random_shape(n)
+    calls = {
+        "rotate_3d":lambda: shp.rotate_3d(axis=[1, 2, 3], angle=0.1),
+        "scale":lambda: shp.scale(factor=1.0),
+        "translate":lambda: shp.translate(direction=(0, 0, 0))
+    }
+
+    def step():
+        calls[method]()
+        shp.apply()
+    return best_time(step)
+
+def bench_constructor(kind):
+    return best_time(lambda: solid(kind, 1000))
+
+def bench_animation_frame(size, nframes=5):
+    grid = Grid([solid("dodecahedron", size)], (size, size))
+    grid.paint_canvas("gradient")
+
+    def frame_func(idx, t, frames):
+        grid.rotate_shape_3d("solid", axis=[1, 0.25, 0.75], angle=0.05)
+        return grid.render_frame(size=(1000, 1000))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        animation = Animation(
+            time=np.arange(nframes),
+            frame_func=frame_func,
+            processed_fname=os.path.join(tmp, "processed.npy")
+        )
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+        try:
+            total = best_time(animation.process_frames, repeat=2, budget=0)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return total / nframes
+
+def run(sizes, vertices):
+    """Returns a dict mapping benchmark names to seconds per call."""
+    results = {}
+    for size in sizes:
+        results[f"draw_edge/{size}"] = bench_draw_edge(size)
+        for kind in ("cube", "dodecahedron"):
+            results[f"draw_shapes/{kind}/{size}"] = bench_draw_shapes(
+                size, kind
+            )
+        for paint in paint_presets():
+            results[f"paint_canvas/{paint}/{size}"] = bench_paint_canvas(
+                size, paint
+            )
+        results[f"animation_frame/{size}"] = bench_animation_frame(size)
+    for n in vertices:
+        for method in ("rotate_3d", "scale", "translate"):
+            results[f"{method}/{n}"] = bench_transform(n, method)
+    for kind in SOLIDS:
+        results[f"shape_lib/{kind}"] = bench_constructor(kind)
+    return results
+
+def compare(results, baseline, threshold, slack=5e-5):
+    """Prints results against the baseline and returns the names of the
+    benchmarks that slowed down by more than "threshold". Slowdowns of less
+    than "slack" seconds per call are treated as timer noise."""
+    slow = []
+    print(f"{'benchmark':<40}{'ms':>12}{'baseline':>12}{'ratio':>8}")
+    for name, secs in results.items():
+        base = baseline.get(name)
+        ratio = secs / base if base else math.nan
+        flag = ""
+        if base and ratio > threshold and secs - base > slack:
+            slow.append(name)
+            flag = "  SLOWER"
+        base_ms = f"{1e3*base:>12.3f}" if base else f"{'-':>12}"
+        print(f"{name:<40}{1e3*secs:>12.3f}{base_ms}{ratio:>8.2f}{flag}")
+    return slow
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--baseline",
+        default="tests/test-output/benchmark-baseline.json",
+        help="JSON file of baseline timings"
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="record the results as the new baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="fail when a benchmark takes this many times its baseline"
+    )
+    parser.add_argument(
+        "--slack",
+        type=float,
+        default=5e-5,
+        help="ignore slowdowns of fewer seconds than this per call"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--vertices", type=int, nargs="+", default=VERTICES)
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.vertices)
+
+    if args.update or not os.path.isfile(args.baseline):
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        compare(results, results, args.threshold)
+        print(f"\nBaseline written to {args.baseline}")
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    slow = compare(results, baseline, args.threshold, args.slack)
+    if slow:
+        print(f"\n{len(slow)} benchmark(s) over {args.threshold}x baseline")
+        sys.exit(1)
+    print("\nNo regressions")
@@ -0,0 +1,41 @@
+import numpy as np
+import os, sys
+import warnings
+
+# add src to sys path
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src"
+    )
+)
+
+from Camera import Camera
+from Grid import Grid
+from shape_lib import *
+
+def test_perspective_culls_vertices_behind_camera():
+    camera = Camera(proj="perspective", focal=200, anchor=(100, 100, 0))
+    points = np.array([[150, 150, 50], [150, 150, -100], [150, 150, -300]])
+    xy, depth = camera.project(points, (200, 200))
+    assert np.isfinite(xy[0]).all()
+    assert np.isnan(xy[1:]).all()
+    assert (depth == points[:, 2]).all()
+
+def test_culled_shape_does_not_blank_frame():
+    camera = Camera(proj="perspective", focal=200, anchor=(100, 100, 0))
+    front = instantiate("cube", "front", (60, 60, 20), 30)
+    behind = instantiate("cube", "behind", (140, 140, -100), 60)
+
+    alone = Grid([instantiate("cube", "front", (60, 60, 20), 30)], (200, 200))
+    alone.draw_shapes(proj=camera)
+    grid = Grid([front, behind], (200, 200))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        grid.draw_shapes(proj=camera)
+
+    # the face of "behind" in front of the camera is drawn, and nothing
+    # drawn by "front" is lost
+    assert (alone.gridarr > 0).any()
+    assert (grid.gridarr[alone.gridarr > 0] > 0).all()
+    assert ((grid.gridarr > 0) & (alone.gridarr == 0)).any()
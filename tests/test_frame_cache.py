@@ -0,0 +1,63 @@
+import numpy as np
+import os, sys
+import pytest
+
+# add src to sys path
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src"
+    )
+)
+
+from Animation import Animation
+from FrameCache import FrameCache, frame_key, scene_params
+from Grid import Grid
+from shape_lib import *
+
+def scene(kind):
+    grid = Grid([instantiate(kind, "solid", (20, 20, 5), 15)], (40, 40))
+    grid.paint_canvas("gradient")
+    return grid
+
+def animate(grid, cache, fname):
+    def frame_func(idx, t, frames):
+        grid.draw_shapes()
+        return grid
+    return Animation(
+        time=np.arange(3),
+        frame_func=frame_func,
+        frame_size=(40, 40),
+        processed_fname=fname,
+        cache=cache,
+        cache_key=scene_params(grid)
+    )
+
+def test_cache_requires_key(tmp_path):
+    with pytest.raises(ValueError):
+        Animation(
+            time=np.arange(3),
+            frame_func=lambda idx, t, frames: None,
+            cache=FrameCache(str(tmp_path / "cache"))
+        )
+
+def test_scenes_sharing_cache_do_not_collide(tmp_path):
+    cache = FrameCache(str(tmp_path / "cache"))
+    kinds = ("cube", "icosahedron")
+    fnames = [str(tmp_path / f"{kind}.npy") for kind in kinds]
+    for kind, fname in zip(kinds, fnames):
+        animate(scene(kind), cache, fname).process_frames()
+    assert cache.hits == 0
+    assert len(cache.entries()) == 6
+    cube, icosahedron = (np.load(fname) for fname in fnames)
+    assert (cube != icosahedron).any()
+
+    # a rerun of either scene is served entirely from the cache
+    animate(scene("cube"), cache, fnames[0]).process_frames()
+    assert cache.hits == 3
+    assert (np.load(fnames[0]) == cube).all()
+
+def test_frame_key_hashes_contents():
+    assert frame_key(np.arange(3), "a") == frame_key(np.arange(3), "a")
+    assert frame_key(np.arange(3)) != frame_key(np.arange(3.0))
+    assert frame_key({"a":1, "b":2}) == frame_key({"b":2, "a":1})
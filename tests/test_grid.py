@@ -0,0 +1,39 @@
+import numpy as np
+import os, sys
+
+# add src to sys path
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src"
+    )
+)
+
+from Grid import Grid
+from shape_lib import *
+
+def solid(kind, center, shade, fill):
+    shp = instantiate(kind, kind + "_" + str(center[2]), center, 40, shade)
+    shp.set_fill(fill)
+    return shp
+
+def draw(shapes, dim=(200, 200)):
+    grid = Grid(shapes, dim)
+    grid.draw_shapes(hidden=True)
+    return grid.gridarr
+
+def test_faces_hide_edges_behind_them():
+    for kind in ("cube", "dodecahedron", "icosahedron"):
+        near = lambda: solid(kind, (100, 100, 20), 1.0, 0.5)
+        far = lambda: solid(kind, (115, 120, 200), 0.8, 0.3)
+        face = draw([near()]) == 0.5
+        for order in ([near(), far()], [far(), near()]):
+            # at most a pixel of the far edges shows along the outline
+            assert ((draw(order) == 0.8) & face).sum() <= 1
+
+def test_faces_keep_their_own_edges():
+    for kind in ("cube", "dodecahedron", "icosahedron"):
+        for dim in ((200, 200), (400, 400)):
+            wire = draw([solid(kind, (100, 100, 20), 1.0, None)], dim) == 1
+            filled = draw([solid(kind, (100, 100, 20), 1.0, 0.5)], dim)
+            assert (filled[wire] == 1).all()
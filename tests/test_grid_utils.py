@@ -0,0 +1,24 @@
+import numpy as np
+import os, sys
+
+# add src to sys path
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src"
+    )
+)
+
+from grid_utils import *
+
+def test_draw_edges_skips_non_finite_segments():
+    dim = (100, 100)
+    starts = np.array([[1, 1], [10, 10], [20, 30], [5, 5]], dtype=float)
+    ends = np.array([[90, 40], [np.inf, 5], [60, 80], [np.nan, 50]])
+    good = np.array([True, False, True, False])
+
+    arr, ref = np.zeros(dim), np.zeros(dim)
+    draw_edges(arr, starts, ends, dim)
+    draw_edges(ref, starts[good], ends[good], dim)
+    assert (arr > 0).any()
+    assert (arr == ref).all()